@@ -16,10 +16,12 @@ if "bpy" in locals():
     importlib.reload(blender_camera)
     importlib.reload(blender_materials)
     importlib.reload(blender_import)
+    importlib.reload(blender_scene)
     importlib.reload(downloader)
     importlib.reload(filesystem)
     importlib.reload(geometry_data)
     importlib.reload(helpers)
+    importlib.reload(import_context)
     importlib.reload(ldraw_camera)
     importlib.reload(ldraw_colors)
     importlib.reload(ldraw_export)
@@ -27,11 +29,15 @@ if "bpy" in locals():
     importlib.reload(ldraw_geometry)
     importlib.reload(ldraw_node)
     importlib.reload(ldraw_part_types)
+    importlib.reload(library_pack)
     importlib.reload(matrices)
     importlib.reload(operator_export)
     importlib.reload(operator_import)
+    importlib.reload(parse_pool)
+    importlib.reload(prefetch)
     importlib.reload(import_options)
     importlib.reload(export_options)
+    importlib.reload(spatial_hash)
     importlib.reload(special_bricks)
     importlib.reload(strings)
     importlib.reload(texmap)
@@ -39,10 +45,12 @@ else:
     from . import blender_camera
     from . import blender_materials
     from . import blender_import
+    from . import blender_scene
     from . import downloader
     from . import filesystem
     from . import geometry_data
     from . import helpers
+    from . import import_context
     from . import ldraw_camera
     from . import ldraw_colors
     from . import ldraw_export
@@ -50,11 +58,15 @@ else:
     from . import ldraw_geometry
     from . import ldraw_node
     from . import ldraw_part_types
+    from . import library_pack
     from . import matrices
     from . import operator_export
     from . import operator_import
+    from . import parse_pool
+    from . import prefetch
     from . import import_options
     from . import export_options
+    from . import spatial_hash
     from . import special_bricks
     from . import strings
     from . import texmap
@@ -0,0 +1,294 @@
+"""Import performance benchmarks. Run from inside of Blender so that the plugin can be imported:
+
+blender -b --python _benchmark.py -- parse <ldraw path> [file count]
+blender -b --python _benchmark.py -- weld <ldraw path> [part or primitive name...]
+blender -b --python _benchmark.py -- traverse [depth] [width]
+blender -b --python _benchmark.py -- pool <ldraw path> <model file>
+"""
+
+import importlib
+import os
+import sys
+import time
+
+import bmesh
+import bpy
+import mathutils
+import numpy as np
+
+this_script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(this_script_dir))
+addon = importlib.import_module(os.path.basename(this_script_dir))
+
+filesystem = addon.filesystem
+helpers = addon.helpers
+blender_scene = addon.blender_scene
+geometry_data = addon.geometry_data
+import_options = addon.import_options
+ldraw_file = addon.ldraw_file
+ldraw_node = addon.ldraw_node
+parse_pool = addon.parse_pool
+ImportContext = addon.import_context.ImportContext
+
+
+# parse_file only, over the first file_count parts of the library, against ChainedLDrawFile's parse_file
+# files are read and their subfiles are parsed before timing starts, so this measures lines/s of the parser itself
+def benchmark_parse(ldraw_path, file_count=2000):
+    filesystem.ldraw_path = ldraw_path
+    filesystem.build_search_paths()
+    ldraw_file.parsed_file_cache.clear()
+    import_context = ImportContext()
+    ldraw_file.read_color_table(import_context)
+
+    parts_path = os.path.join(filesystem.get_library_path(), 'parts')
+    filenames = [f for f in sorted(os.listdir(parts_path)) if f.lower().endswith('.dat')][:file_count]
+    for filename in filenames:
+        ldraw_file.LDrawFile.get_file(import_context, filename)
+    filenames = [f for f in filenames if f in import_context.file_lines_cache]
+
+    counts = {}
+    for name, file_class in (("chained", ChainedLDrawFile), ("dispatch", ldraw_file.LDrawFile)):
+        line_count = 0
+        node_count = 0
+        start = time.perf_counter()
+        for filename in filenames:
+            file = file_class(filename)
+            file.lines = import_context.file_lines_cache[filename].lines
+            file.parse_file(import_context)
+            import_context.texmap = None
+            import_context.texmaps = []
+            line_count += len(file.lines)
+            node_count += len(file.child_nodes)
+        elapsed = time.perf_counter() - start
+        counts[name] = node_count
+
+        print(f"parse {name}: {line_count} lines in {len(filenames)} files, {elapsed:.3f}s, {line_count / elapsed:.0f} lines/s")
+
+    if counts["chained"] != counts["dispatch"]:
+        print(f"parse: chained made {counts['chained']} nodes and dispatch made {counts['dispatch']}")
+
+
+# the meta commands parse_file checked every line against, in order, before lines were dispatched by their first tokens
+chained_meta_prefixes = [
+    "0 !LDRAW_ORG ",
+    "0 LDRAW_ORG ",
+    "0 Official LCAD ",
+    "0 Unofficial ",
+    "0 Un-official ",
+    "0 !COLOUR ",
+    "0 STEP",
+    "0 SAVE",
+    "0 CLEAR",
+    "0 PRINT",
+    "0 WRITE",
+    "0 !LDCAD GROUP_DEF ",
+    "0 !LDCAD GROUP_NXT ",
+    "0 !LEOCAD GROUP BEGIN ",
+    "0 !LEOCAD GROUP END",
+    "0 !LEOCAD CAMERA ",
+    "0 !TEXMAP ",
+]
+
+
+class ChainedLDrawFile(ldraw_file.LDrawFile):
+    """
+    LDrawFile with parse_file's per-line path from before lines were dispatched by their first tokens:
+    every line is lowercased for 0 Name: and 0 Author: and checked against every meta command in turn,
+    and only then tried as a geometry line. A matching line goes to the same handler, so both parse the same.
+    """
+
+    def parse_lines(self, import_context):
+        for line in self.lines:
+            clean_line = helpers.clean_line(line)
+            if clean_line == "":
+                continue
+            _params = clean_line.split(maxsplit=2)
+
+            handler = None
+            if clean_line.lower().startswith("0 name: "):
+                handler = ldraw_file.LDrawFile.parse_name
+            elif clean_line.lower().startswith("0 author: "):
+                handler = ldraw_file.LDrawFile.parse_author
+            else:
+                for prefix in chained_meta_prefixes:
+                    if clean_line.startswith(prefix):
+                        handler = ldraw_file.meta_handlers.get(_params[1])
+                        break
+            if handler is not None and handler(self, import_context, line, clean_line, _params):
+                continue
+
+            if self.texmap_start:
+                if clean_line.startswith('0 !: '):
+                    self.parse_geometry_line(import_context, clean_line[len('0 !: '):].strip())
+                elif _params[0] in ldraw_file.geometry_line_types:
+                    self.parse_geometry_line(import_context, clean_line)
+                if self.texmap_next:
+                    self.set_texmap_end(import_context)
+                continue
+
+            if _params[0] in ldraw_file.geometry_line_types:
+                if not self.texmap_fallback:
+                    self.parse_geometry_line(import_context, clean_line)
+                continue
+
+            if _params[0] == "0":
+                if self.texmap_next or clean_line.startswith("0 //"):
+                    continue
+                if self.description is None and len(_params) > 1:
+                    self.description = clean_line.split(maxsplit=1)[1]
+
+
+# FaceBuffers.weld against bmesh.ops.remove_doubles on the same faces of high vertex count parts,
+# and on a chain of points that have to be merged the same way
+def benchmark_weld(ldraw_path, *filenames):
+    filenames = filenames or ("3811.dat", "4186.dat", "48\\4-4cyli.dat", "48\\4-4disc.dat", "48\\4-4ring10.dat")
+
+    filesystem.ldraw_path = ldraw_path
+    filesystem.build_search_paths()
+    ldraw_file.parsed_file_cache.clear()
+    import_context = ImportContext()
+    ldraw_file.read_color_table(import_context)
+    distance = import_options.merge_distance
+
+    for filename in filenames:
+        file = ldraw_file.LDrawFile.get_file(import_context, filename)
+        if file is None:
+            print(f"{filename}: not found")
+            continue
+        compare_weld(filename, ldraw_node.get_geometry_data(import_context, file, "16").get_face_buffers(), distance)
+
+    compare_weld("chain", chain_face_buffers(distance), distance)
+
+
+# a triangle for each point of a chain of points closer than distance to the next one, but not to the one after it
+# remove_doubles merges every other point of the chain into the one before it, not the whole chain into one
+def chain_face_buffers(distance, point_count=10):
+    vertices = []
+    for i in range(point_count):
+        vertices.extend(((i * distance * 0.8, 0, 0), (i, 1, 0), (i, 2, 0)))
+    return geometry_data.FaceBuffers(
+        np.array(vertices, dtype=np.float32),
+        np.arange(0, point_count * 3 + 1, 3, dtype=np.int32),
+        np.zeros(point_count, dtype=np.int32),
+        [("16", None)],
+    )
+
+
+def compare_weld(name, face_buffers, distance):
+    start = time.perf_counter()
+    welded, vertex_map = face_buffers.weld(distance)
+    weld_time = time.perf_counter() - start
+
+    mesh = bpy.data.meshes.new(name)
+    blender_scene.set_mesh_geometry(mesh, face_buffers, [0] * len(face_buffers.material_keys))
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    start = time.perf_counter()
+    bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=distance)
+    remove_doubles_time = time.perf_counter() - start
+    bm_counts = (len(bm.verts), len(bm.faces))
+    bm.free()
+    bpy.data.meshes.remove(mesh)
+
+    same = "same" if (len(welded.vertices), len(welded)) == bm_counts else "DIFFERENT"
+    print(
+        f"{name}: {len(face_buffers.vertices)} vertices, "
+        f"weld {weld_time:.3f}s => {len(welded.vertices)} vertices {len(welded)} faces, "
+        f"remove_doubles {remove_doubles_time:.3f}s => {bm_counts[0]} vertices {bm_counts[1]} faces, {same}"
+    )
+
+
+def synthetic_file(name, part_type, child_files):
+    file = ldraw_file.LDrawFile(name)
+    file.part_type = part_type
+    for i, child_file in enumerate(child_files):
+        node = ldraw_node.LDrawNode()
+        node.file = child_file
+        node.color_code = "4"
+        node.matrix = mathutils.Matrix.Translation((i * 20, -8, 0))
+        file.child_nodes.append(node)
+    return file
+
+
+# how many nodes a traversal of file goes through, with every submodel and shortcut expanded
+def count_nodes(file):
+    count = 0
+    stack = [file]
+    while len(stack) > 0:
+        file = stack.pop()
+        for child_node in file.child_nodes:
+            count += 1
+            if child_node.file.is_model() or child_node.file.is_shortcut():
+                stack.append(child_node.file)
+    return count
+
+
+# ldraw_node.resolve over hierarchies made in memory, so nothing is read or parsed
+# deep ones are chains of depth shortcuts or submodels that each place the next one and a part, like nested LSynth hoses
+# wide ones are a model that places width parts, or width / 10 submodels that each place 10 parts
+def benchmark_traverse(depth=5000, width=100000):
+    import_options.meta_step = False
+    import_options.instance_submodels = False
+    part = synthetic_file("3001.dat", "part", [])
+
+    hierarchies = []
+    for part_type in ["shortcut", "model"]:
+        file = part
+        for i in range(depth):
+            file = synthetic_file(f"{part_type}{i}.ldr", part_type, [file, part])
+        hierarchies.append((f"deep {part_type}", synthetic_file("deep.ldr", "model", [file])))
+
+    hierarchies.append(("wide parts", synthetic_file("wide.ldr", "model", [part] * width)))
+    submodel = synthetic_file("submodel.ldr", "model", [part] * 10)
+    hierarchies.append(("wide submodels", synthetic_file("wide.ldr", "model", [submodel] * (width // 10))))
+
+    for name, file in hierarchies:
+        node_count = count_nodes(file)
+
+        start = time.perf_counter()
+        instance_table = ldraw_node.resolve(ImportContext(), file)
+        elapsed = time.perf_counter() - start
+
+        print(f"traverse {name}: {node_count} nodes, {len(instance_table.instances)} instances, {elapsed:.3f}s, {node_count / elapsed:.0f} nodes/s")
+
+
+# LDrawFile.get_file of a model without and with parse_pool, both with nothing parsed yet
+# process time is only this process's, which is how much of the parse is left to it
+def benchmark_pool(ldraw_path, filepath):
+    filesystem.ldraw_path = ldraw_path
+    python_executable = getattr(bpy.app, 'binary_path_python', sys.executable)
+
+    for use_pool in [False, True]:
+        filesystem.build_search_paths(parent_filepath=filepath)
+        ldraw_file.parsed_file_cache.clear()
+        import_context = ImportContext()
+        ldraw_file.read_color_table(import_context)
+
+        start = time.perf_counter()
+        process_start = time.process_time()
+        if use_pool:
+            parse_pool.parse_dependencies(import_context, filepath, python_executable)
+        ldraw_file.LDrawFile.get_file(import_context, filepath)
+        elapsed = time.perf_counter() - start
+        process_elapsed = time.process_time() - process_start
+
+        name = "pool" if use_pool else "serial"
+        print(f"{name}: {len(import_context.file_cache)} files, {elapsed:.3f}s, {process_elapsed:.3f}s in this process, {os.cpu_count()} cpus")
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if len(argv) < 1 or (len(argv) < 2 and argv[0] != "traverse"):
+        exit(__doc__)
+
+    benchmark = argv[0]
+    if benchmark == "parse":
+        benchmark_parse(argv[1], *map(int, argv[2:3]))
+    elif benchmark == "weld":
+        benchmark_weld(argv[1], *argv[2:])
+    elif benchmark == "traverse":
+        benchmark_traverse(*map(int, argv[1:3]))
+    elif benchmark == "pool":
+        benchmark_pool(argv[1], argv[2])
+    else:
+        exit(f"unknown benchmark {benchmark}")
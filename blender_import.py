@@ -1,54 +1,70 @@
+import sys
+
 import bpy
 import bmesh
 
 from . import blender_materials
+from . import blender_scene
 from . import import_options
 from . import ldraw_file
 from . import ldraw_node
-from . import ldraw_camera
+from . import parse_pool
 from . import filesystem
 from . import blender_camera
 from . import helpers
 from . import ldraw_colors
 from . import strings
-from . import texmap
 from . import special_bricks
+from .import_context import ImportContext
+from .prefetch import Prefetcher
 
 
+# returns the ImportContext of the import
 def do_import(filepath):
     print(filepath)  # TODO: multiple filepaths?
 
     scene_setup()
-    ldraw_file.reset_caches()
-    ldraw_node.reset_caches()
-    ldraw_camera.reset_caches()
-    texmap.reset_caches()
+    import_context = ImportContext()
+    blender_scene.reset_caches()
     filesystem.build_search_paths(parent_filepath=filepath)
     special_bricks.reset()
-    ldraw_file.read_color_table()
+    ldraw_file.read_color_table(import_context)
     blender_materials.create_blender_node_groups()
 
-    file = ldraw_file.LDrawFile.get_file(filepath)
+    if import_options.parallel_parse:
+        # before 2.91, sys.executable is Blender itself and this is the python it comes with
+        python_executable = getattr(bpy.app, 'binary_path_python', sys.executable)
+        parse_pool.parse_dependencies(import_context, filepath, python_executable)
+
+    if import_options.prefetch_files:
+        import_context.prefetcher = Prefetcher()
+    try:
+        file = ldraw_file.LDrawFile.get_file(import_context, filepath)
+    finally:
+        if import_context.prefetcher is not None:
+            import_context.prefetcher.close()
+    ldraw_file.drop_unread_files(import_context)
+
     if file is None:
-        return
+        report_missing_files()
+        return import_context
 
     if file.is_configuration():
         load_materials(file)
-        return
+        report_missing_files()
+        return import_context
 
-    root_node = ldraw_node.LDrawNode()
-    root_node.is_root = True
-    root_node.file = file
-    root_node.load()
+    instance_table = ldraw_node.resolve(import_context, file)
+    blender_scene.create_scene(file, instance_table)
 
     if import_options.meta_step:
         if import_options.set_end_frame:
-            bpy.context.scene.frame_end = ldraw_node.current_frame + import_options.frames_per_step
+            bpy.context.scene.frame_end = instance_table.current_frame + import_options.frames_per_step
             bpy.context.scene.frame_set(bpy.context.scene.frame_end)
 
     max_clip_end = 0
-    for camera in ldraw_camera.cameras:
-        camera = blender_camera.create_camera(camera, empty=ldraw_node.top_empty, collection=ldraw_node.top_collection)
+    for camera in import_context.cameras:
+        camera = blender_camera.create_camera(camera, empty=blender_scene.top_empty, collection=blender_scene.top_collection)
         if bpy.context.scene.camera is None:
             if camera.data.clip_end > max_clip_end:
                 max_clip_end = camera.data.clip_end
@@ -61,6 +77,18 @@ def do_import(filepath):
                     if space.clip_end < max_clip_end:
                         space.clip_end = max_clip_end
 
+    report_missing_files()
+    return import_context
+
+
+def report_missing_files():
+    if len(filesystem.missing_files) < 1:
+        return
+
+    print(f"Missing files: {len(filesystem.missing_files)}")
+    for filename, count in filesystem.missing_files.values():
+        print(f"missing {filename} ({count} references)")
+
 
 def scene_setup():
     bpy.context.scene.eevee.use_ssr = True
@@ -58,6 +58,66 @@ def get_material(color_code, use_edge_color=False, part_slopes=None, texmap=None
     return material
 
 
+# the colors whose material is only the standard material in that color
+# a part in one of these colors can share its mesh with the same part in any other of them
+def is_standard_color(color):
+    if color.alpha < 1.0:
+        return False
+    if color.name == "Milky_White" or 'Opal' in color.name:
+        return False
+    if color.luminance > 0:
+        return False
+    return color.material_name not in ["glitter", "speckle", "chrome", "pearlescent", "metal", "rubber"]
+
+
+# the material of faces that inherit the color of a shared mesh
+# the color comes from the object's color, which is set to the color the part was placed with
+def get_object_color_material(part_slopes=None, texmap=None):
+    _key = []
+    _key.append("LDraw Material")
+    _key.append("Object Color")
+    if part_slopes is not None:
+        _key.append("_".join([str(k) for k in part_slopes]))
+    if texmap is not None:
+        texmap_suffix = "_".join([str(k) for k in [texmap.method, texmap.texture, texmap.glossmap] if k != ''])
+        _key.append(texmap_suffix)
+    key = " ".join([str(k) for k in _key])
+
+    if key in bpy.data.materials:
+        return bpy.data.materials[key]
+
+    material = bpy.data.materials.new(key)
+    material.use_fake_user = True
+    material.use_nodes = True
+
+    nodes = material.node_tree.nodes
+    links = material.node_tree.links
+
+    nodes.clear()
+
+    diff_color = (1.0, 1.0, 1.0, 1.0)
+    material["LEGO.isTransparent"] = False
+    material[strings.ldraw_color_code_key] = "16"
+
+    __create_cycles_standard(nodes, links, diff_color)
+
+    if texmap is not None:
+        __create_texmap_texture(nodes, links, diff_color, texmap)
+
+    if part_slopes is not None:
+        __create_cycles_slope_texture(nodes, links, part_slopes)
+
+    # the texmap's mix node takes the place of the group's color input if there is one
+    color_input = __get_group(nodes).inputs["Color"]
+    for node in nodes:
+        if node.type == "MIX_RGB":
+            color_input = node.inputs["Color1"]
+    object_info = __node_object_info(nodes, -500.0, 280.0)
+    links.new(object_info.outputs["Color"], color_input)
+
+    return material
+
+
 def __create_node_based_material(key, color, use_edge_color=False, part_slopes=None, texmap=None):
     """Set Cycles Material Values."""
 
@@ -261,6 +321,12 @@ def __node_lego_milky_white(nodes, color, x, y):
     return node
 
 
+def __node_object_info(nodes, x, y):
+    node = nodes.new("ShaderNodeObjectInfo")
+    node.location = x, y
+    return node
+
+
 def __node_output(nodes, x, y):
     node = nodes.new("ShaderNodeOutputMaterial")
     node.location = x, y
@@ -305,7 +371,7 @@ def __create_texmap_texture(nodes, links, diff_color, texmap):
         if image_name not in bpy.data.images:
             image_path = filesystem.locate(image_name)
             if image_path is not None:
-                image = bpy.data.images.load(image_path)
+                image = bpy.data.images.load(filesystem.get_local_path(image_path))
                 image.name = image_name
                 image[strings.ldraw_filename_key] = image_name
                 image.colorspace_settings.name = 'sRGB'
@@ -331,7 +397,7 @@ def __create_texmap_texture(nodes, links, diff_color, texmap):
         if image_name not in bpy.data.images:
             image_path = filesystem.locate(image_name)
             if image_path is not None:
-                image = bpy.data.images.load(image_path)
+                image = bpy.data.images.load(filesystem.get_local_path(image_path))
                 image.name = image_name
                 image[strings.ldraw_filename_key] = image_name
                 image.colorspace_settings.name = 'Non-Color'
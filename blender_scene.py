@@ -0,0 +1,696 @@
+import math
+import os
+import uuid
+
+import bmesh
+import bpy
+import mathutils
+import numpy as np
+
+from . import blender_materials
+from . import ldraw_colors
+from . import ldraw_node
+from . import import_options
+from . import matrices
+from . import special_bricks
+from . import strings
+
+# the ImportContext of the InstanceTable being created
+import_context = None
+part_count = 0
+top_collection = None
+top_empty = None
+gap_scale_empty = None
+key_map = dict()
+point_instances = dict()
+submodel_collections = dict()
+submodel_depth = 0
+
+import_scale_matrix = None
+gap_scale_matrix = None
+
+
+def reset_caches():
+    global import_context
+    global part_count
+    global top_collection
+    global top_empty
+    global gap_scale_empty
+    global key_map
+    global point_instances
+    global submodel_collections
+    global submodel_depth
+    global import_scale_matrix
+    global gap_scale_matrix
+
+    import_context = None
+    part_count = 0
+    top_collection = None
+    top_empty = None
+    gap_scale_empty = None
+    key_map = dict()
+    point_instances = dict()
+    submodel_collections = dict()
+    submodel_depth = 0
+
+    scale = import_options.import_scale
+    import_scale_matrix = mathutils.Matrix.Scale(scale, 4).freeze()
+    # Matrix(((0.2, 0.0, 0.0, 0.0),
+    #         (0.0, 0.2, 0.0, 0.0),
+    #         (0.0, 0.0, 0.2, 0.0),
+    #         (0.0, 0.0, 0.0, 1.0)))
+
+    scale = import_options.gap_scale
+    gap_scale_matrix = mathutils.Matrix.Scale(scale, 4).freeze()
+    # Matrix(((0.997, 0.0, 0.0, 0.0),
+    #         (0.0, 0.997, 0.0, 0.0),
+    #         (0.0, 0.0, 0.997, 0.0),
+    #         (0.0, 0.0, 0.0, 1.0)))
+
+
+# the second phase of an import, every collection, mesh and object of a resolved InstanceTable
+def create_scene(file, instance_table):
+    global import_context
+    global top_collection
+    global top_empty
+
+    import_context = instance_table.import_context
+
+    if import_options.meta_group:
+        groups_collection = get_collection('Groups', bpy.context.scene.collection)
+        for collection_name, parent_name in instance_table.group_links:
+            collection = get_collection(collection_name, groups_collection)
+            if parent_name is not None:
+                parent_collection = bpy.data.collections[parent_name]
+                if collection.name not in parent_collection.children:
+                    parent_collection.children.link(collection)
+
+    if import_options.meta_step_groups:
+        steps_collection = get_collection('Steps', bpy.context.scene.collection)
+        for collection_name in instance_table.step_groups:
+            get_collection(collection_name, steps_collection)
+
+    for marker_name, frame in instance_table.markers:
+        bpy.context.scene.timeline_markers.new(marker_name, frame=frame)
+
+    collections = dict()
+    for models in instance_table.model_chains:
+        collections[models] = get_model_collection(models[-1], collections.get(models[:-1]))
+
+    # if importing anything but a model, create a group for that part
+    if top_collection is None:
+        collection_name = os.path.basename(file.name)
+        top_collection = bpy.data.collections.new(collection_name)
+    collections[()] = top_collection
+
+    top_empty = bpy.data.objects.new(top_collection.name, None)
+    top_collection.objects.link(top_empty)
+
+    instance_objects = []
+    for instance in instance_table.instances:
+        instance_objects.append(create_instance(instance, collections[instance.models]))
+
+    if use_point_instancing():
+        create_point_instances()
+
+    if import_options.meta_step or import_options.meta_clear:
+        create_visibility_keyframes(instance_table, instance_objects)
+
+
+def get_collection(collection_name, parent_collection):
+    if collection_name not in bpy.data.collections:
+        collection = bpy.data.collections.new(collection_name)
+        parent_collection.children.link(collection)
+    return bpy.data.collections[collection_name]
+
+
+# returns the objects that were made for the instance
+def create_instance(instance, collection):
+    if instance.submodel_table is not None:
+        return create_submodel_instance(instance, collection)
+    return create_part(instance, collection)
+
+
+def create_part(instance, collection):
+    global part_count
+
+    part_count += 1
+
+    # the part is built as if it were placed with color code 16 so that every plain color shares its mesh
+    # the faces that inherit the color take it from the object's color instead
+    mesh_color_code = instance.color_code
+    if use_shared_meshes() and blender_materials.is_standard_color(ldraw_colors.get_color(instance.color_code)):
+        mesh_color_code = "16"
+
+    key, e_key = get_part_meshes(instance.file, mesh_color_code, instance.is_edge_logo)
+    mesh = bpy.data.meshes[key]
+
+    if use_point_instancing():
+        edge_mesh = bpy.data.meshes[e_key] if import_options.import_edges else None
+        if add_point_instance(instance.file.name, mesh, edge_mesh, instance.color_code, instance.matrix):
+            return []
+
+    obj = do_create_object(mesh)
+    obj[strings.ldraw_filename_key] = instance.file.name
+
+    # bpy.context.space_data.shading.color_type = 'MATERIAL'
+    # bpy.context.space_data.shading.color_type = 'OBJECT'
+    # Shading > Color > Object to see object colors
+    color = ldraw_colors.get_color(instance.color_code)
+    obj.color = color.color + (color.alpha,)
+
+    set_object_matrix(obj, instance.matrix)
+
+    if import_options.smooth_type == "edge_split":
+        edge_modifier = obj.modifiers.new("Edge Split", type='EDGE_SPLIT')
+        edge_modifier.use_edge_angle = True
+        edge_modifier.split_angle = math.radians(89.9)
+        edge_modifier.use_edge_sharp = True
+
+    # https://b3d.interplanety.org/en/how-to-get-global-vertex-coordinates/
+    link_object(obj, instance, collection)
+    objects = [obj]
+
+    if import_options.import_edges:
+        edge_mesh = bpy.data.meshes[e_key]
+        edge_obj = do_create_object(edge_mesh)
+        edge_obj[strings.ldraw_filename_key] = f"{instance.file.name}_edges"
+
+        edge_obj.parent = obj
+        edge_obj.matrix_world = obj.matrix_world
+
+        link_object(edge_obj, instance, collection)
+        objects.append(edge_obj)
+
+    return objects
+
+
+def link_object(obj, instance, collection):
+    collection.objects.link(obj)
+
+    if instance.step_group is not None:
+        bpy.data.collections[instance.step_group].objects.link(obj)
+
+    if import_options.meta_group and submodel_depth == 0:
+        if instance.group is not None:
+            bpy.data.collections[instance.group].objects.link(obj)
+        else:
+            ungrouped_collection = get_collection('Ungrouped', bpy.data.collections['Groups'])
+            ungrouped_collection.objects.link(obj)
+
+
+# the part's mesh and edge mesh, made the first time the part is placed with color_code
+# returns their names
+def get_part_meshes(file, color_code, is_edge_logo):
+    _key = []
+    _key.append(file.name)
+    _key.append(color_code)
+    _key.append(hash(matrices.identity.freeze()))
+    _key = "_".join([str(k).lower() for k in _key])
+
+    if _key not in key_map:
+        key_map[_key] = str(uuid.uuid4())
+    key = key_map[_key]
+    e_key = f"e_{key}"
+
+    if key in bpy.data.meshes:
+        return key, e_key
+
+    geometry_data = ldraw_node.get_geometry_data(import_context, file, color_code, is_edge_logo)
+
+    mesh = bpy.data.meshes.new(key)
+    mesh.name = key
+    mesh[strings.ldraw_filename_key] = file.name
+
+    # https://blender.stackexchange.com/questions/50160/scripting-low-level-join-meshes-elements-hopefully-with-bmesh
+    # https://blender.stackexchange.com/questions/188039/how-to-join-only-two-objects-to-create-a-new-object-using-python
+    # FIXME: 31313 - Mindstorms EV3 - Spike3r.mpd - "31313 - 13710ac01.dat"
+    # FIXME: if not treat_shortcut_as_model, texmap uvs may be incorrect, caused by unexpected part transform?
+    face_buffers = geometry_data.get_face_buffers()
+    if import_options.remove_doubles:
+        # TODO: if vertices in sharp edge collection, do not add to merge collection
+        face_buffers, vertex_map = face_buffers.weld(import_options.merge_distance)
+
+    # increase the distance to look for edges to merge
+    # merge line type 2 edges at a greater distance than mesh edges
+    distance = import_options.merge_distance * 2
+
+    # Find the mesh edges that line type 2 edges run along, they are made sharp (i.e. not smooth)
+    edge_buffers = geometry_data.get_edge_buffers()
+    sharp_edges = face_buffers.find_sharp_edges(edge_buffers, distance)
+
+    if import_options.remove_doubles and len(sharp_edges) > 0:
+        # if it was detected as a edge, then merge those vertices
+        face_buffers, vertex_map = face_buffers.weld(distance, vertex_indexes=np.unique(sharp_edges))
+        sharp_edges = np.sort(vertex_map[sharp_edges], axis=1)
+        sharp_edges = sharp_edges[(sharp_edges[:, 0] >= 0) & (sharp_edges[:, 0] != sharp_edges[:, 1])]
+
+    material_indexes = get_material_indexes(file, mesh, face_buffers.material_keys)
+    set_mesh_geometry(mesh, face_buffers, material_indexes)
+
+    has_texmaps = any(texmap is not None for color_code, texmap in face_buffers.material_keys)
+    if has_texmaps or import_options.recalculate_normals:
+        bm = bmesh.new()
+        bm.from_mesh(mesh)
+        bm.faces.ensure_lookup_table()
+
+        unwrap_texmaps(bm, face_buffers)
+
+        if import_options.recalculate_normals:
+            bmesh.ops.recalc_face_normals(bm, faces=bm.faces[:])
+
+        bm.to_mesh(mesh)
+        bm.clear()
+        bm.free()
+
+    mesh.update()
+    mesh.validate()
+
+    set_sharp_edges(mesh, sharp_edges)
+
+    edge_mesh = bpy.data.meshes.new(e_key)
+    edge_mesh.name = e_key
+    edge_mesh[strings.ldraw_filename_key] = file.name
+
+    e_verts = edge_buffers.vertices.tolist()
+    e_edges = []
+    e_faces = edge_buffers.loop_vertices.reshape(-1, 2).tolist()
+
+    edge_mesh.from_pydata(e_verts, e_edges, e_faces)
+    edge_mesh.update()
+    edge_mesh.validate()
+
+    if import_options.smooth_type == "auto_smooth":
+        mesh.use_auto_smooth = import_options.shade_smooth
+        auto_smooth_angle = 31
+        auto_smooth_angle = 44.97
+        auto_smooth_angle = 51.1
+        auto_smooth_angle = 89.9  # 1.56905 - 89.9 so 90 degrees and up are affected
+        mesh.auto_smooth_angle = math.radians(auto_smooth_angle)
+
+    if import_options.make_gaps and import_options.gap_target == "mesh":
+        mesh.transform(gap_scale_matrix)
+        edge_mesh.transform(gap_scale_matrix)
+
+    return key, e_key
+
+
+# the submodel is built once in its own collection, in its own space, and placed here as an instance of it
+def create_submodel_instance(instance, parent_collection):
+    global submodel_depth
+
+    _key = (instance.file.name, instance.color_code)
+    if _key not in submodel_collections:
+        collection_name = 'Submodels'
+        if collection_name not in bpy.data.collections:
+            submodels_collection = bpy.data.collections.new(collection_name)
+            bpy.context.scene.collection.children.link(submodels_collection)
+            submodels_collection.hide_viewport = True
+            submodels_collection.hide_render = True
+        submodels_collection = bpy.data.collections[collection_name]
+
+        collection = bpy.data.collections.new(os.path.basename(instance.file.name[:63]))
+        collection[strings.ldraw_filename_key] = instance.file.name
+        submodels_collection.children.link(collection)
+
+        submodel_depth += 1
+        for submodel_instance in instance.submodel_table.instances:
+            create_instance(submodel_instance, collection)
+        submodel_depth -= 1
+
+        submodel_collections[_key] = collection
+    collection = submodel_collections[_key]
+
+    obj = bpy.data.objects.new(collection.name, None)
+    obj.instance_type = 'COLLECTION'
+    obj.instance_collection = collection
+    obj[strings.ldraw_filename_key] = instance.file.name
+    set_object_matrix(obj, instance.matrix, use_gaps=False)
+    parent_collection.objects.link(obj)
+    return [obj]
+
+
+# obj.show_name = True
+def do_create_object(mesh):
+    if import_options.instancing:
+        part_collection = get_part_collection(mesh)
+
+        obj = bpy.data.objects.new(mesh.name, None)
+        obj.instance_type = 'COLLECTION'
+        obj.instance_collection = part_collection
+    else:
+        obj = bpy.data.objects.new(mesh.name, mesh)
+    return obj
+
+
+# the collection of a model file, linked into parent_collection unless it is the first one
+def get_model_collection(file, parent_collection):
+    global top_collection
+
+    collection_name = os.path.basename(file.name[:63])
+    if collection_name not in bpy.data.collections:
+        bpy.data.collections.new(collection_name)
+    collection = bpy.data.collections[collection_name]
+    collection[strings.ldraw_filename_key] = file.name
+
+    if top_collection is None:
+        top_collection = collection
+        if top_collection.name not in bpy.context.scene.collection.children:
+            bpy.context.scene.collection.children.link(top_collection)
+    else:
+        if parent_collection is not None:
+            if collection.name not in parent_collection.children:
+                parent_collection.children.link(collection)
+
+    return collection
+
+
+# a hidden collection holding an object of mesh, for instancing
+def get_part_collection(mesh):
+    if mesh.name not in bpy.data.objects:
+        bpy.data.objects.new(mesh.name, mesh)
+    instanced_obj = bpy.data.objects[mesh.name]
+
+    collection_name = 'Parts'
+    if collection_name not in bpy.data.collections:
+        parts_collection = bpy.data.collections.new(collection_name)
+        bpy.context.scene.collection.children.link(parts_collection)
+        parts_collection.hide_viewport = True
+        parts_collection.hide_render = True
+    parts_collection = bpy.data.collections[collection_name]
+
+    collection_name = mesh.name
+    if collection_name not in bpy.data.collections:
+        part_collection = bpy.data.collections.new(collection_name)
+        parts_collection.children.link(part_collection)
+    part_collection = bpy.data.collections[collection_name]
+
+    if instanced_obj.name not in part_collection.objects:
+        part_collection.objects.link(instanced_obj)
+
+    return part_collection
+
+
+# Object Info gives the color of the object that is instanced, not of the one instancing it,
+# so with any kind of instancing every copy of a shared mesh would have the same color
+# this is decided once for the whole import, because meshes are reused by their key
+def use_shared_meshes():
+    if not import_options.shared_meshes:
+        return False
+    if import_options.instancing or import_options.point_instancing:
+        return False
+    return not ldraw_node.use_submodel_instancing()
+
+
+# Instance on Points needs the Named Attribute node, which was added in 3.2
+# every part gets its own object when steps are imported, so that each one can be keyframed
+def use_point_instancing():
+    if not import_options.point_instancing:
+        return False
+    if import_options.meta_step:
+        return False
+    if submodel_depth > 0:
+        return False
+    return bpy.app.version >= (3, 2, 0)
+
+
+# returns False if matrix can't be stored as a location, rotation and scale, which is the case if it is sheared
+def add_point_instance(filename, mesh, edge_mesh, color_code, matrix):
+    if import_options.make_gaps and import_options.gap_target == "object":
+        matrix = matrix @ gap_scale_matrix
+
+    location, rotation, scale = matrix.decompose()
+    recomposed = mathutils.Matrix.LocRotScale(location, rotation, scale)
+    if not np.allclose(np.array(recomposed), np.array(matrix), atol=1e-4):
+        return False
+
+    edge_mesh_name = None if edge_mesh is None else edge_mesh.name
+    _key = (filename, mesh.name, edge_mesh_name, color_code)
+    point_instances.setdefault(_key, []).append((location, rotation.to_euler(), scale))
+    return True
+
+
+# one object for each part and color, with a point for every time the part was placed in that color
+# the points are turned into instances of the part by a geometry nodes modifier
+def create_point_instances():
+    for (filename, mesh_name, edge_mesh_name, color_code), instances in point_instances.items():
+        mesh = bpy.data.meshes[mesh_name]
+        part_collection = get_part_collection(mesh)
+
+        instanced_obj = bpy.data.objects[mesh.name]
+        if import_options.smooth_type == "edge_split" and len(instanced_obj.modifiers) < 1:
+            edge_modifier = instanced_obj.modifiers.new("Edge Split", type='EDGE_SPLIT')
+            edge_modifier.use_edge_angle = True
+            edge_modifier.split_angle = math.radians(89.9)
+            edge_modifier.use_edge_sharp = True
+
+        if edge_mesh_name is not None:
+            if edge_mesh_name not in bpy.data.objects:
+                bpy.data.objects.new(edge_mesh_name, bpy.data.meshes[edge_mesh_name])
+            edge_obj = bpy.data.objects[edge_mesh_name]
+            if edge_obj.name not in part_collection.objects:
+                part_collection.objects.link(edge_obj)
+
+        points = bpy.data.meshes.new(f"{mesh.name}_points")
+        points.vertices.add(len(instances))
+        points.vertices.foreach_set("co", np.array([i[0] for i in instances], dtype=np.float32).ravel())
+        rotations = points.attributes.new("rotation", 'FLOAT_VECTOR', 'POINT')
+        rotations.data.foreach_set("vector", np.array([i[1] for i in instances], dtype=np.float32).ravel())
+        scales = points.attributes.new("scale", 'FLOAT_VECTOR', 'POINT')
+        scales.data.foreach_set("vector", np.array([i[2] for i in instances], dtype=np.float32).ravel())
+
+        obj = bpy.data.objects.new(mesh.name, points)
+        obj[strings.ldraw_filename_key] = filename
+        color = ldraw_colors.get_color(color_code)
+        obj.color = color.color + (color.alpha,)
+
+        node_modifier = obj.modifiers.new("Point Instances", type='NODES')
+        node_modifier.node_group = get_point_instance_node_group(part_collection)
+
+        transform_matrix = matrices.identity @ matrices.rotation @ import_scale_matrix
+        if import_options.parent_to_empty:
+            top_empty.matrix_world = transform_matrix
+            obj.parent = top_empty
+        else:
+            obj.matrix_world = transform_matrix
+
+        top_collection.objects.link(obj)
+
+
+def new_node_group_socket(node_group, in_out, socket_type, name):
+    if bpy.app.version >= (4, 0, 0):
+        return node_group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
+    if in_out == 'INPUT':
+        return node_group.inputs.new(socket_type, name)
+    return node_group.outputs.new(socket_type, name)
+
+
+# the part's collection instanced on every point, rotated and scaled by the point's attributes
+def get_point_instance_node_group(part_collection):
+    group_name = f"{part_collection.name}_points"
+    if group_name in bpy.data.node_groups:
+        return bpy.data.node_groups[group_name]
+
+    node_group = bpy.data.node_groups.new(group_name, 'GeometryNodeTree')
+    new_node_group_socket(node_group, 'INPUT', 'NodeSocketGeometry', "Geometry")
+    new_node_group_socket(node_group, 'OUTPUT', 'NodeSocketGeometry', "Geometry")
+
+    nodes = node_group.nodes
+    links = node_group.links
+
+    group_input = nodes.new("NodeGroupInput")
+    group_input.location = -600, 0
+
+    collection_info = nodes.new("GeometryNodeCollectionInfo")
+    collection_info.location = -400, -100
+    collection_info.inputs["Collection"].default_value = part_collection
+
+    rotation = nodes.new("GeometryNodeInputNamedAttribute")
+    rotation.location = -400, -300
+    rotation.data_type = 'FLOAT_VECTOR'
+    rotation.inputs["Name"].default_value = "rotation"
+
+    scale = nodes.new("GeometryNodeInputNamedAttribute")
+    scale.location = -400, -450
+    scale.data_type = 'FLOAT_VECTOR'
+    scale.inputs["Name"].default_value = "scale"
+
+    instance_on_points = nodes.new("GeometryNodeInstanceOnPoints")
+    instance_on_points.location = -150, 0
+
+    group_output = nodes.new("NodeGroupOutput")
+    group_output.location = 100, 0
+
+    links.new(group_input.outputs[0], instance_on_points.inputs["Points"])
+    links.new(collection_info.outputs["Instances"], instance_on_points.inputs["Instance"])
+    links.new(rotation.outputs["Attribute"], instance_on_points.inputs["Rotation"])
+    links.new(scale.outputs["Attribute"], instance_on_points.inputs["Scale"])
+    links.new(instance_on_points.outputs["Instances"], group_output.inputs[0])
+
+    return node_group
+
+
+# every object's visibility comes down to the frame of the step it is placed in and the frame of the first CLEAR after it
+# objects with the same pair of frames share one action, so the keyframes are written once per pair
+def create_visibility_keyframes(instance_table, instance_objects):
+    clear_events = instance_table.clear_events
+    visibility_actions = dict()
+
+    event_index = 0
+    for i, instance in enumerate(instance_table.instances):
+        while event_index < len(clear_events) and clear_events[event_index][1] <= i:
+            event_index += 1
+
+        clear_frame = None
+        if event_index < len(clear_events):
+            clear_frame = clear_events[event_index][0]
+
+        _key = (instance.frame, clear_frame)
+        if _key == (None, None):
+            continue
+
+        if _key not in visibility_actions:
+            action_name = []
+            if instance.frame is not None:
+                action_name.append(f"Step {instance.frame}")
+            if clear_frame is not None:
+                action_name.append(f"Clear {clear_frame}")
+            action = bpy.data.actions.new(" ".join(action_name))
+            add_visibility_keyframes(action, instance.frame, clear_frame)
+            visibility_actions[_key] = action
+
+        for obj in instance_objects[i]:
+            if obj.animation_data is None:
+                obj.animation_data_create()
+            obj.animation_data.action = visibility_actions[_key]
+
+    bpy.context.scene.frame_set(instance_table.current_frame)
+
+
+# https://docs.blender.org/api/current/bpy.types.bpy_struct.html#bpy.types.bpy_struct.keyframe_insert
+# 1.0 is hidden and 0.0 is shown
+# the object is hidden on the starting step frame and shown on its step's frame
+# a CLEAR on the same frame as the step the object appears on hides it
+def add_visibility_keyframes(action, step_frame, clear_frame):
+    keyframes = dict()
+    if step_frame is not None:
+        keyframes[import_options.starting_step_frame] = 1.0
+        keyframes[step_frame] = 0.0
+    if clear_frame is not None:
+        keyframes[clear_frame] = 1.0
+
+    co = []
+    for frame in sorted(keyframes):
+        co.extend([frame, keyframes[frame]])
+
+    for data_path in ["hide_render", "hide_viewport"]:
+        fcurve = action.fcurves.new(data_path)
+        fcurve.keyframe_points.add(len(keyframes))
+        fcurve.keyframe_points.foreach_set("co", co)
+        fcurve.keyframe_points.foreach_set("interpolation", [0] * len(keyframes))  # CONSTANT
+        fcurve.update()
+
+
+# objects in a submodel's collection are placed in the submodel's space and are moved by its instances
+# the gaps are left out of an instance's matrix because the objects it instances already have them
+def set_object_matrix(obj, matrix, use_gaps=True):
+    use_gaps = use_gaps and import_options.make_gaps and import_options.gap_target == "object"
+
+    if submodel_depth > 0:
+        if use_gaps:
+            matrix = matrix @ gap_scale_matrix
+        obj.matrix_world = matrix
+        return
+
+    transform_matrix = matrices.identity @ matrices.rotation @ import_scale_matrix
+
+    if not import_options.parent_to_empty:
+        matrix_world = transform_matrix @ matrix
+
+        if use_gaps:
+            matrix_world = matrix_world @ gap_scale_matrix
+
+        obj.matrix_world = matrix_world
+        return
+
+    top_empty.matrix_world = transform_matrix
+    obj.matrix_world = matrix
+
+    if use_gaps:
+        if import_options.gap_scale_strategy == "object":
+            matrix_world = obj.matrix_world @ gap_scale_matrix
+            obj.matrix_world = matrix_world
+        elif import_options.gap_scale_strategy == "constraint":
+            global gap_scale_empty
+            if gap_scale_empty is None:
+                gap_scale_empty = bpy.data.objects.new("gap_scale", None)
+                matrix_world = gap_scale_empty.matrix_world @ gap_scale_matrix
+                gap_scale_empty.matrix_world = matrix_world
+                top_collection.objects.link(gap_scale_empty)
+            copy_scale_constraint = obj.constraints.new("COPY_SCALE")
+            copy_scale_constraint.target = gap_scale_empty
+            copy_scale_constraint.target.parent = top_empty
+
+    obj.parent = top_empty  # must be after matrix_world set or else transform is incorrect
+
+
+# each (color code, texmap) pair gets its material looked up and its slot found once per mesh
+def get_material_indexes(file, mesh, material_keys):
+    part_slopes = special_bricks.get_part_slopes(file.name)
+
+    material_indexes = []
+    for color_code, texmap in material_keys:
+        if use_shared_meshes() and color_code == "16":
+            material = blender_materials.get_object_color_material(part_slopes=part_slopes, texmap=texmap)
+        else:
+            material = blender_materials.get_material(color_code, part_slopes=part_slopes, texmap=texmap)
+        # https://blender.stackexchange.com/questions/23905/select-faces-depending-on-material
+        if material.name not in mesh.materials:
+            mesh.materials.append(material)
+        material_indexes.append(mesh.materials.find(material.name))
+    return material_indexes
+
+
+# vertices, loops and polygons are created in bulk
+def set_mesh_geometry(mesh, face_buffers, material_indexes):
+    face_count = len(face_buffers)
+    loop_count = int(face_buffers.offsets[-1])
+
+    mesh.vertices.add(len(face_buffers.vertices))
+    mesh.loops.add(loop_count)
+    mesh.polygons.add(face_count)
+
+    mesh.vertices.foreach_set("co", face_buffers.vertices.astype(np.float32).ravel())
+    mesh.loops.foreach_set("vertex_index", face_buffers.loop_vertices)
+    mesh.polygons.foreach_set("loop_start", face_buffers.offsets[:-1].astype(np.int32))
+    mesh.polygons.foreach_set("loop_total", np.diff(face_buffers.offsets).astype(np.int32))
+    material_indexes = np.array(material_indexes, dtype=np.int32)
+    mesh.polygons.foreach_set("material_index", material_indexes[face_buffers.material_indexes])
+    mesh.polygons.foreach_set("use_smooth", np.full(face_count, import_options.shade_smooth, dtype=bool))
+
+    mesh.update(calc_edges=True)
+
+
+# uv unwrapping works on bmesh faces, which are in the same order as the mesh's polygons
+def unwrap_texmaps(bm, face_buffers):
+    for key_index, (color_code, texmap) in enumerate(face_buffers.material_keys):
+        if texmap is None:
+            continue
+        for i in np.flatnonzero(face_buffers.material_indexes == key_index).tolist():
+            texmap.uv_unwrap_face(bm, bm.faces[i])
+
+
+# bpy.context.object.data.edges[6].use_edge_sharp = True
+def set_sharp_edges(mesh, sharp_edges):
+    edge_count = len(mesh.edges)
+    edge_vertices = np.empty(edge_count * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edge_vertices)
+    edge_vertices = np.sort(edge_vertices.reshape(-1, 2), axis=1).astype(np.int64)
+
+    vertex_count = len(mesh.vertices)
+    is_sharp = np.isin(
+        edge_vertices[:, 0] * vertex_count + edge_vertices[:, 1],
+        sharp_edges[:, 0] * vertex_count + sharp_edges[:, 1],
+    )
+    mesh.edges.foreach_set("use_edge_sharp", is_sharp)
+    mesh.edges.foreach_set("use_freestyle_mark", is_sharp)
@@ -1,9 +1,14 @@
+import io
 import os
 import string
-import glob
+import tempfile
+import zipfile
 from sys import platform
 from pathlib import Path
 
+from . import helpers
+from . import library_pack
+
 defaults = dict()
 defaults['ldraw_path'] = ''
 defaults['prefer_unofficial'] = False
@@ -13,22 +18,49 @@ ldraw_path = defaults['ldraw_path']
 prefer_unofficial = defaults['prefer_unofficial']
 resolution = defaults['resolution']
 
+# set up for each import and, like the rest of the state below, only used from the main thread
 search_paths = []
+search_roots = []
 texture_paths = []
-lowercase_paths = {}
+resolved_paths = {}
+# {lowercase name: [name as first referenced, reference count]} for names that could not be located this session
+missing_files = {}
+# {filepath: modified time} looked up this import, files aren't expected to change during one
+mtimes = {}
+
+# persists between imports and is saved to config so that a warm import doesn't have to walk the library
+library_index_filename = 'library_index.json'
+library_index = None
+library_index_changed = False
+
+# {zip path: LibraryArchive} kept open between imports
+archives = {}
 
 
 def reset_caches():
     global search_paths
+    global search_roots
     global texture_paths
-    global lowercase_paths
+    global resolved_paths
+    global missing_files
+    global mtimes
     search_paths = []
+    search_roots = []
     texture_paths = []
-    lowercase_paths = {}
+    resolved_paths = {}
+    missing_files = {}
+    mtimes = {}
 
 
 def append_search_path(path):
-    if path[0] != "" and os.path.isdir(path[0]):
+    if path[0] == "":
+        return
+
+    archive = get_archive(path[0])
+    if archive is not None:
+        if archive.is_dir(path[0]):
+            search_paths.append(path)
+    elif os.path.isdir(path[0]):
         search_paths.append(path)
 
 
@@ -55,13 +87,103 @@ def locate_ldraw():
     return ""
 
 
-def build_lowercase_paths():
-    global lowercase_paths
-    lowercase_paths = {}
+# {lowercase relative name: full path} for every file in search_paths
+# search_paths is walked in order and the first root that has a name wins, so precedence is resolved here once
+# instead of on every call to locate
+def build_resolved_paths():
+    global resolved_paths
+    resolved_paths = {}
 
     for path in search_paths:
-        for file in glob.glob(os.path.join(path[0], path[1])):
-            lowercase_paths[file.lower()] = file
+        if path[0] not in search_roots:
+            search_roots.append(path[0])
+
+    for root in search_roots:
+        for lower_name, name in get_root_index(root).items():
+            if lower_name not in resolved_paths:
+                resolved_paths[lower_name] = os.path.join(root, name)
+
+    save_library_index()
+
+
+def read_library_index():
+    global library_index
+    if library_index is None:
+        library_index = {}
+        this_script_dir = os.path.dirname(os.path.realpath(__file__))
+        if os.path.isfile(os.path.join(this_script_dir, 'config', library_index_filename)):
+            library_index = helpers.read_json('config', library_index_filename, {})
+    return library_index
+
+
+# only library folders are saved, the folder of the imported model is indexed for this session only
+# without a library path there is nothing to tell them apart by, so nothing is saved
+def save_library_index():
+    global library_index_changed
+    if not library_index_changed:
+        return
+    library_index_changed = False
+
+    if ldraw_path == '':
+        return
+
+    library_root = os.path.join(ldraw_path, '')
+    saved_index = {root: entry for root, entry in library_index.items() if root.startswith(library_root)}
+    helpers.write_json('config', library_index_filename, saved_index)
+
+
+# returns {lowercase relative name: relative name} for root
+# the index is rebuilt only if root or one of its folders has been modified since it was indexed
+def get_root_index(root):
+    global library_index_changed
+
+    archive = get_archive(root)
+    if archive is not None:
+        return archive.get_root_index(root)
+
+    index = read_library_index()
+    entry = index.get(root)
+    if entry is None or not is_root_index_current(root, entry):
+        entry = index_root(root)
+        index[root] = entry
+        library_index_changed = True
+    return entry['files']
+
+
+# adding, removing or renaming a file changes the modified time of the folder it is in
+def is_root_index_current(root, entry):
+    for folder, mtime in entry['folders'].items():
+        try:
+            if os.stat(os.path.join(root, folder)).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+# same depth as globbing root/* and root/**/* without recursive=True
+def index_root(root):
+    folders = {'': os.stat(root).st_mtime}
+    files = {}
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_file():
+                files[entry.name.lower()] = entry.name
+            elif entry.is_dir():
+                try:
+                    folders[entry.name] = entry.stat().st_mtime
+                    with os.scandir(entry.path) as sub_entries:
+                        for sub_entry in sub_entries:
+                            if sub_entry.name.startswith('.'):
+                                continue
+                            if sub_entry.is_file():
+                                name = os.path.join(entry.name, sub_entry.name)
+                                files[name.lower()] = name
+                except OSError as e:
+                    print(e)
+    return {'folders': folders, 'files': files}
 
 
 def build_search_paths(parent_filepath=None):
@@ -73,69 +195,283 @@ def build_search_paths(parent_filepath=None):
         append_search_path((os.path.dirname(parent_filepath), '**/*'))
         append_search_path((os.path.dirname(parent_filepath), '*'))
 
-    append_search_path((os.path.join(ldraw_path), '*'))
+    library_path = get_library_path()
+    append_search_path((os.path.join(library_path), '*'))
 
     if prefer_unofficial:
-        append_unofficial_paths()
-        append_official_paths()
+        append_unofficial_paths(library_path)
+        append_official_paths(library_path)
     else:
-        append_official_paths()
-        append_unofficial_paths()
+        append_official_paths(library_path)
+        append_unofficial_paths(library_path)
 
-    build_lowercase_paths()
+    build_resolved_paths()
 
 
-def append_paths(folder=''):
-    append_search_path((os.path.join(ldraw_path, folder, "models"), '**/*'))
-    append_search_path((os.path.join(ldraw_path, folder, "models"), '*'))
+def append_paths(library_path, folder=''):
+    append_search_path((os.path.join(library_path, folder, "models"), '**/*'))
+    append_search_path((os.path.join(library_path, folder, "models"), '*'))
 
-    append_search_path((os.path.join(ldraw_path, folder, "parts", "textures"), '**/*'))
-    append_search_path((os.path.join(ldraw_path, folder, "parts", "textures"), '*'))
+    append_search_path((os.path.join(library_path, folder, "parts", "textures"), '**/*'))
+    append_search_path((os.path.join(library_path, folder, "parts", "textures"), '*'))
 
-    append_search_path((os.path.join(ldraw_path, folder, "parts"), '**/*'))
-    append_search_path((os.path.join(ldraw_path, folder, "parts"), '*'))
+    append_search_path((os.path.join(library_path, folder, "parts"), '**/*'))
+    append_search_path((os.path.join(library_path, folder, "parts"), '*'))
 
     if resolution == "High":
-        append_search_path((os.path.join(ldraw_path, folder, "p", "48"), '**/*'))
-        append_search_path((os.path.join(ldraw_path, folder, "p", "48"), '*'))
+        append_search_path((os.path.join(library_path, folder, "p", "48"), '**/*'))
+        append_search_path((os.path.join(library_path, folder, "p", "48"), '*'))
     elif resolution == "Low":
-        append_search_path((os.path.join(ldraw_path, folder, "p", "8"), '**/*'))
-        append_search_path((os.path.join(ldraw_path, folder, "p", "8"), '*'))
-
-    append_search_path((os.path.join(ldraw_path, folder, "p"), '**/*'))
-    append_search_path((os.path.join(ldraw_path, folder, "p"), '*'))
-
+        append_search_path((os.path.join(library_path, folder, "p", "8"), '**/*'))
+        append_search_path((os.path.join(library_path, folder, "p", "8"), '*'))
 
-def append_official_paths():
-    append_paths()
+    append_search_path((os.path.join(library_path, folder, "p"), '**/*'))
+    append_search_path((os.path.join(library_path, folder, "p"), '*'))
 
 
-def append_unofficial_paths():
-    append_paths(folder="unofficial")
+def append_official_paths(library_path):
+    append_paths(library_path)
 
 
-# https://stackoverflow.com/a/8462613
-def path_lowercase(path):
-    if path.lower() in lowercase_paths:
-        return lowercase_paths[path.lower()]
-    return path
+def append_unofficial_paths(library_path):
+    append_paths(library_path, folder="unofficial")
 
 
-def locate(filename):
+# count_missing is False when looking ahead for files the import will locate anyway
+def locate(filename, count_missing=True):
     part_path = filename.replace("\\", os.path.sep).replace("/", os.path.sep)
     part_path = os.path.expanduser(part_path)
 
+    lower_path = part_path.lower()
+    full_path = resolved_paths.get(lower_path)
+    if full_path is not None:
+        return full_path
+
+    if lower_path in missing_files:
+        if count_missing:
+            missing_files[lower_path][1] += 1
+        return None
+
     # full path was specified
-    if os.path.isfile(part_path):
+    if os.path.isabs(part_path) and os.path.isfile(part_path):
         return part_path
 
-    for path in search_paths:
-        full_path = os.path.join(path[0], part_path)
-        full_path = path_lowercase(full_path)
-        if os.path.isfile(full_path):
-            return full_path
+    # names in folders deeper than the index goes are looked for in every root
+    full_path = locate_in_roots(part_path)
+    if full_path is not None:
+        resolved_paths[lower_path] = full_path
+        return full_path
 
     # TODO: requests retrieve missing items from ldraw.org
 
-    print(f"missing {filename}")
+    if count_missing:
+        missing_files[lower_path] = [filename, 1]
+    return None
+
+
+def locate_in_roots(part_path):
+    for root in search_roots:
+        full_path = os.path.join(root, part_path)
+        archive = get_archive(root)
+        if archive is not None:
+            if archive.is_file(full_path):
+                return full_path
+        elif os.path.isfile(full_path):
+            return full_path
+    return None
+
+
+def open_file(filepath):
+    archive = get_archive(filepath)
+    if archive is not None:
+        return archive.open(filepath)
+    return open(filepath, mode='r', encoding='utf-8')
+
+
+# the whole file in one read, which is safe to do from any thread
+def read_bytes(filepath):
+    archive = get_archive(filepath)
+    if archive is not None:
+        return archive.read_bytes(filepath)
+    with open(filepath, mode='rb') as file:
+        return file.read()
+
+
+# an archive's members all share its modified time
+# each file's is only looked up once per import
+def get_mtime(filepath):
+    mtime = mtimes.get(filepath)
+    if mtime is None:
+        archive = get_archive(filepath)
+        if archive is not None:
+            mtime = archive.mtime
+        else:
+            mtime = os.stat(filepath).st_mtime
+        mtimes[filepath] = mtime
+    return mtime
+
+
+# files inside of an archive are extracted so that they can be loaded by things that need a real file, like images
+def get_local_path(filepath):
+    archive = get_archive(filepath)
+    if archive is not None:
+        return archive.extract(filepath, os.path.join(tempfile.gettempdir(), 'ldraw_archive'))
+    return filepath
+
+
+# ldraw_path can be the official complete.zip or a pack built with library_pack.py instead of a folder
+# complete.zip has everything in an ldraw folder
+def get_library_path():
+    if os.path.isfile(ldraw_path):
+        ext = os.path.splitext(ldraw_path)[1].lower()
+        if ext == '.zip':
+            archive = open_archive(ldraw_path, ZipLibraryArchive)
+            library_path = os.path.join(ldraw_path, 'ldraw')
+            if archive.is_dir(library_path):
+                return library_path
+        elif ext == '.ldpack':
+            open_archive(ldraw_path, PackLibraryArchive)
+    return ldraw_path
+
+
+def open_archive(filepath, archive_class):
+    archive = archives.get(filepath)
+    if archive is not None:
+        if archive.mtime == os.stat(filepath).st_mtime:
+            return archive
+        archive.close()
+
+    archive = archive_class(filepath)
+    archives[filepath] = archive
+    return archive
+
+
+def get_archive(path):
+    for archive_path, archive in archives.items():
+        if path == archive_path or path.startswith(os.path.join(archive_path, '')):
+            return archive
     return None
+
+
+class LibraryArchive:
+    """
+    A single file used as an LDraw library folder. The archive's own table of contents is used as the file index
+    and members are only read when they are opened.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.mtime = os.stat(filepath).st_mtime
+        self.members = {}
+        self.folders = set()
+        self.root_indexes = {}
+
+    def add_member(self, name, is_dir=False):
+        lower_name = name.lower().rstrip('/')
+        parts = lower_name.split('/')
+        for i in range(1, len(parts)):
+            self.folders.add('/'.join(parts[:i]))
+        if is_dir:
+            self.folders.add(lower_name)
+        else:
+            self.members[lower_name] = name
+
+    def close(self):
+        pass
+
+    # path inside of the archive, using the separator and case of the archive's table of contents
+    def get_member_name(self, path):
+        if path == self.filepath:
+            return ''
+        return os.path.relpath(path, self.filepath).replace(os.path.sep, '/').lower()
+
+    def is_file(self, path):
+        return self.get_member_name(path) in self.members
+
+    def is_dir(self, path):
+        member_name = self.get_member_name(path)
+        return member_name == '' or member_name in self.folders
+
+    # same depth as index_root
+    def get_root_index(self, root):
+        if root in self.root_indexes:
+            return self.root_indexes[root]
+
+        prefix = self.get_member_name(root)
+        if prefix != '':
+            prefix = f"{prefix}/"
+        files = {}
+        for lower_name, name in self.members.items():
+            if not lower_name.startswith(prefix):
+                continue
+            relative_name = name[len(prefix):]
+            if relative_name.count('/') > 1:
+                continue
+            relative_name = relative_name.replace('/', os.path.sep)
+            files[relative_name.lower()] = relative_name
+
+        self.root_indexes[root] = files
+        return files
+
+
+class ZipLibraryArchive(LibraryArchive):
+    """
+    The official complete.zip. The central directory is the file index.
+    """
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self.zip_file = zipfile.ZipFile(filepath)
+        for info in self.zip_file.infolist():
+            self.add_member(info.filename, is_dir=info.is_dir())
+
+    def close(self):
+        self.zip_file.close()
+
+    def open(self, path):
+        member = self.members[self.get_member_name(path)]
+        return io.TextIOWrapper(self.zip_file.open(member), encoding='utf-8')
+
+    def read_bytes(self, path):
+        member = self.members[self.get_member_name(path)]
+        return self.zip_file.read(member)
+
+    def extract(self, path, destination):
+        member = self.members[self.get_member_name(path)]
+        return self.zip_file.extract(member, os.path.join(destination, os.path.basename(self.filepath)))
+
+
+class PackLibraryArchive(LibraryArchive):
+    """
+    A pack built by library_pack.py. The pack is memory mapped, so opening a member doesn't touch the filesystem.
+    """
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self.pack_file = library_pack.PackFile(filepath)
+        for name in self.pack_file.names():
+            self.add_member(name)
+
+    def close(self):
+        self.pack_file.close()
+
+    def read(self, path):
+        member = self.members[self.get_member_name(path)]
+        return self.pack_file.read(member)
+
+    def open(self, path):
+        with self.read(path) as body:
+            return io.StringIO(str(body, 'utf-8'), newline=None)
+
+    def read_bytes(self, path):
+        with self.read(path) as body:
+            return bytes(body)
+
+    def extract(self, path, destination):
+        member = self.members[self.get_member_name(path)]
+        extract_path = os.path.join(destination, os.path.basename(self.filepath), *member.split('/'))
+        Path(os.path.dirname(extract_path)).mkdir(parents=True, exist_ok=True)
+        with self.read(path) as body:
+            with open(extract_path, 'wb') as file:
+                file.write(body)
+        return extract_path
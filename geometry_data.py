@@ -1,17 +1,166 @@
+import numpy as np
+
+from . import spatial_hash
+
+
 class FaceData:
     """
-    The data required to transform a file's face info into the needed mesh part.
+    The data required to transform a file's face arrays into the needed mesh part.
     """
 
-    def __init__(self, matrix, color_code, face_infos):
+    def __init__(self, matrix, color_code, face_arrays):
         self.matrix = matrix
         self.color_code = color_code
-        self.face_infos = face_infos
+        self.face_arrays = face_arrays
+
+
+class FaceBuffers:
+    """
+    The world space vertices of every face in a list of FaceData, ready to be made into a mesh.
+    Face i is vertices[loop_vertices[offsets[i]:offsets[i + 1]]] and uses material_keys[material_indexes[i]],
+    a (color code, texmap) pair. Until weld is called every face has its own vertices.
+    """
+
+    def __init__(self, vertices, offsets, material_indexes, material_keys, loop_vertices=None):
+        self.vertices = vertices
+        self.offsets = offsets
+        self.material_indexes = material_indexes
+        self.material_keys = material_keys
+        if loop_vertices is None:
+            loop_vertices = np.arange(offsets[-1], dtype=np.int32)
+        self.loop_vertices = loop_vertices
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # one matrix multiply per FaceData instead of one per vertex
+    @classmethod
+    def build(cls, face_data):
+        vertex_blocks = []
+        offset_blocks = [np.zeros(1, dtype=np.int32)]
+        material_blocks = []
+        material_keys = []
+        key_indexes = {}
+
+        vert_start = 0
+        for fd in face_data:
+            face_arrays = fd.face_arrays
+            if len(face_arrays) < 1:
+                continue
+
+            matrix = np.array(fd.matrix, dtype=np.float64)
+            vertex_blocks.append(face_arrays.vertices @ matrix[:3, :3].T + matrix[:3, 3])
+            offset_blocks.append(face_arrays.offsets[1:] + vert_start)
+            vert_start += len(face_arrays.vertices)
+
+            # each distinct color and texmap pair of this block is looked up once, in the order they are first used
+            texmap_count = len(face_arrays.texmaps) + 1
+            pairs = face_arrays.colors * texmap_count + (face_arrays.texmap_indexes + 1)
+            unique_pairs, first_indexes, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+            lookup = np.empty(len(unique_pairs), dtype=np.int32)
+            for i in np.argsort(first_indexes).tolist():
+                color_index, texmap_index = divmod(int(unique_pairs[i]), texmap_count)
+                color_code = face_arrays.color_codes[color_index]
+                if color_code == "16":
+                    color_code = fd.color_code
+                texmap = None if texmap_index == 0 else face_arrays.texmaps[texmap_index - 1]
+
+                key = (color_code, texmap)
+                if key not in key_indexes:
+                    key_indexes[key] = len(material_keys)
+                    material_keys.append(key)
+                lookup[i] = key_indexes[key]
+            material_blocks.append(lookup[inverse.ravel()])
+
+        if len(vertex_blocks) < 1:
+            return cls(np.empty((0, 3), dtype=np.float64), offset_blocks[0], np.empty(0, dtype=np.int32), material_keys)
+
+        return cls(
+            np.concatenate(vertex_blocks),
+            np.concatenate(offset_blocks),
+            np.concatenate(material_blocks),
+            material_keys,
+        )
+
+    # the same result as bmesh.ops.remove_doubles, before there is a mesh
+    # faces that lose a corner become triangles and faces that are left with less than 3 corners are removed
+    # so are faces with two corners that aren't next to each other welded together, which aren't valid polygons,
+    # and faces left with the same corners as a face before them
+    # only vertex_indexes are merged if it is given
+    # returns the welded buffers and the new index of every vertex, -1 if it is no longer used
+    def weld(self, distance, vertex_indexes=None):
+        if vertex_indexes is None:
+            labels = spatial_hash.weld_labels(self.vertices, distance)
+        else:
+            labels = np.arange(len(self.vertices))
+            labels[vertex_indexes] = vertex_indexes[spatial_hash.weld_labels(self.vertices[vertex_indexes], distance)]
+        loop_vertices = labels[self.loop_vertices]
+
+        face_count = len(self)
+        sizes = np.diff(self.offsets)
+        loop_faces = np.repeat(np.arange(face_count), sizes)
+        keep_loops = loop_vertices != loop_vertices[self.get_next_loops()]
+
+        kept_loop_faces = loop_faces[keep_loops]
+        sizes = np.bincount(kept_loop_faces, minlength=face_count)
+        keep_faces = sizes >= 3
+
+        # the corners of every face sorted into a row, padded with -1
+        corners = np.full((face_count, max(int(sizes.max(initial=0)), 1)), -1, dtype=np.int64)
+        corner_positions = np.arange(len(kept_loop_faces)) - (np.cumsum(sizes) - sizes)[kept_loop_faces]
+        corners[kept_loop_faces, corner_positions] = loop_vertices[keep_loops]
+        corners.sort(axis=1)
+        keep_faces &= ~np.any((corners[:, 1:] == corners[:, :-1]) & (corners[:, 1:] >= 0), axis=1)
+        face_indexes = np.flatnonzero(keep_faces)
+        first_faces, _ = spatial_hash.unique_rows(corners[face_indexes])
+        keep_faces[:] = False
+        keep_faces[face_indexes[first_faces]] = True
+        keep_loops &= keep_faces[loop_faces]
+
+        used_vertices, loop_vertices = np.unique(loop_vertices[keep_loops], return_inverse=True)
+        offsets = np.zeros(np.count_nonzero(keep_faces) + 1, dtype=np.int32)
+        np.cumsum(sizes[keep_faces], out=offsets[1:])
+
+        vertex_map = np.full(len(self.vertices), -1, dtype=np.int64)
+        vertex_map[used_vertices] = np.arange(len(used_vertices))
+
+        return FaceBuffers(
+            self.vertices[used_vertices],
+            offsets,
+            self.material_indexes[keep_faces],
+            self.material_keys,
+            loop_vertices.ravel().astype(np.int32),
+        ), vertex_map[labels]
+
+    # the loop after each loop in its face, wrapping around to the face's first loop
+    def get_next_loops(self):
+        next_loops = np.arange(1, len(self.loop_vertices) + 1)
+        next_loops[self.offsets[1:] - 1] = self.offsets[:-1]
+        return next_loops
+
+    # lower vertex index * vertex count + higher vertex index of every edge of every face, each edge once
+    def get_edge_keys(self):
+        a = self.loop_vertices.astype(np.int64)
+        b = a[self.get_next_loops()]
+        return np.unique(np.minimum(a, b) * len(self.vertices) + np.maximum(a, b))
+
+    # the face edges that an edge line runs along, as (n, 2) vertex pairs with the lower index first
+    # an edge line matches an edge if each of its ends is within distance of one of the edge's vertices
+    def find_sharp_edges(self, edge_buffers, distance):
+        line_ends = edge_buffers.vertices[edge_buffers.loop_vertices].reshape(-1, 2, 3)
+        a, b = spatial_hash.find_line_pairs(self.vertices, line_ends[:, 0], line_ends[:, 1], distance)
+        vertex_count = len(self.vertices)
+        line_keys = np.minimum(a, b) * vertex_count + np.maximum(a, b)
+
+        edge_keys = self.get_edge_keys()
+        sharp_keys = edge_keys[np.isin(edge_keys, line_keys)]
+        return np.stack(np.divmod(sharp_keys, max(vertex_count, 1)), axis=1)
 
 
 class GeometryData:
     """
     Accumulated FaceData used to build the final mesh.
+    The face arrays are shared with the file's geometry, not copied.
     """
 
     def __init__(self):
@@ -27,7 +176,7 @@ class GeometryData:
         self.edge_data.append(FaceData(
             matrix=matrix,
             color_code=color_code,
-            face_infos=geometry.edge_infos,
+            face_arrays=geometry.edges,
         ))
 
     def add_face_data(self, matrix, color_code, geometry):
@@ -35,7 +184,7 @@ class GeometryData:
         self.face_data.append(FaceData(
             matrix=matrix,
             color_code=color_code,
-            face_infos=geometry.face_infos,
+            face_arrays=geometry.faces,
         ))
 
     def add_line_data(self, matrix, color_code, geometry):
@@ -43,5 +192,11 @@ class GeometryData:
         self.line_data.append(FaceData(
             matrix=matrix,
             color_code=color_code,
-            face_infos=geometry.line_infos,
+            face_arrays=geometry.lines,
         ))
+
+    def get_face_buffers(self):
+        return FaceBuffers.build(self.face_data)
+
+    def get_edge_buffers(self):
+        return FaceBuffers.build(self.edge_data)
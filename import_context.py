@@ -0,0 +1,41 @@
+class ImportContext:
+    """
+    The state of one import's files, passed to everything that parses or resolves, instead of being kept in module
+    globals. Nothing outlives it except ldraw_file.parsed_file_cache, so a new one is a cold import and two of them
+    never see each other's files.
+
+    Not all of an import's state is here. filesystem's search paths, resolved paths, missing files and modified times,
+    the ldraw_colors color table and blender_materials' keys are still module globals, which only the main thread
+    uses. The prefetcher's threads only read bytes with filesystem.read_bytes, and parse_pool's workers are
+    processes of their own, so parsing can't be run on more than one thread at a time.
+
+    file_lines_cache is {filename: ldraw_file.FileLines} and file_cache is {key: parsed LDrawFile},
+    where key_map turns a file's name and texmap into its key. texmap is the texmap being parsed and texmaps are
+    the ones it is nested in. cameras are the cameras the import's files define.
+    read_ahead_data is {filepath: bytes} for files parse_pool has read, and parsed_geometry is
+    {filepath: LDrawGeometry} and read_ahead_lines is {filepath: lines} for files it has parsed,
+    that haven't been parsed by LDrawFile yet. The lines of a parsed file are only its lines that aren't
+    type 2 to 5 lines.
+    prefetcher is the Prefetcher reading files ahead of the parser, if there is one.
+    geometry_data_cache, flattened_models, submodel_tables and unfilled_submodel_tables are what ldraw_node has
+    worked out for this import's files.
+    """
+
+    def __init__(self):
+        self.file_lines_cache = {}
+        self.file_cache = {}
+        self.key_map = {}
+        self.read_ahead_data = {}
+        self.read_ahead_lines = {}
+        self.parsed_geometry = {}
+        self.prefetcher = None
+
+        self.texmap = None
+        self.texmaps = []
+
+        self.cameras = []
+
+        self.geometry_data_cache = {}
+        self.flattened_models = {}
+        self.submodel_tables = {}
+        self.unfilled_submodel_tables = []
@@ -30,6 +30,11 @@ defaults['parent_to_empty'] = True  # True False
 defaults['treat_shortcut_as_model'] = True  # False TODO: parent to empty at median of group
 defaults['sharpen_edges'] = True
 defaults['instancing'] = False
+defaults['shared_meshes'] = False
+defaults['point_instancing'] = False
+defaults['instance_submodels'] = False
+defaults['parallel_parse'] = False
+defaults['prefetch_files'] = False
 
 remove_doubles = defaults['remove_doubles']
 merge_distance = defaults['merge_distance']
@@ -62,3 +67,8 @@ recalculate_normals = defaults['recalculate_normals']
 triangulate = defaults['triangulate']
 sharpen_edges = defaults['sharpen_edges']
 instancing = defaults['instancing']
+shared_meshes = defaults['shared_meshes']
+point_instancing = defaults['point_instancing']
+instance_submodels = defaults['instance_submodels']
+parallel_parse = defaults['parallel_parse']
+prefetch_files = defaults['prefetch_files']
@@ -1,12 +1,5 @@
 import mathutils
 
-cameras = []
-
-
-def reset_caches():
-    global cameras
-    cameras = []
-
 
 class LDrawCamera:
     """Data about a camera"""
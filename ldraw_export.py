@@ -9,6 +9,7 @@ from . import filesystem
 from . import matrices
 from . import helpers
 from . import ldraw_part_types
+from .import_context import ImportContext
 
 
 # https://devtalk.blender.org/t/to-mesh-and-creating-new-object-issues/8557/4
@@ -193,7 +194,7 @@ def export_polygons(obj, lines):
 # otherwise line type 1
 def do_export(filepath):
     filesystem.build_search_paths()
-    ldraw_file.read_color_table()
+    ldraw_file.read_color_table(ImportContext())
 
     active_object = bpy.context.object
     all_objects = bpy.context.scene.objects
@@ -1,3 +1,4 @@
+import io
 import os
 import re
 import mathutils
@@ -14,23 +15,15 @@ from .ldraw_geometry import LDrawGeometry
 from .texmap import TexMap
 from . import ldraw_colors
 from . import ldraw_camera
-from . import texmap
 
-file_lines_cache = {}
-file_cache = {}
-key_map = {}
+# parsed parts are kept between imports so that common parts are only parsed once per session
+# {(filepath, library and parse options): LDrawFile}
+# an entry is only used while every file it was parsed from, itself and the files it references, is unchanged,
+# and every name it references still resolves to the same file
+parsed_file_cache = {}
 
 
-def reset_caches():
-    global file_lines_cache
-    global file_cache
-    global key_map
-    file_lines_cache = {}
-    file_cache = {}
-    key_map = {}
-
-
-def read_color_table():
+def read_color_table(import_context):
     ldraw_colors.reset_caches()
 
     """Reads the color values from the LDConfig.ldr file. For details of the
@@ -41,11 +34,219 @@ def read_color_table():
     else:
         filename = "LDConfig.ldr"
 
-    ldraw_file = LDrawFile.get_file(filename)
+    ldraw_file = LDrawFile.get_file(import_context, filename)
     if ldraw_file is None:
         return
 
 
+# the folder of the imported model isn't part of the key, so that models in different folders share their parts
+# what the names a file references resolve to is checked by get_parsed_file instead
+def get_parsed_file_key(filepath):
+    return (
+        filepath,
+        filesystem.ldraw_path,
+        filesystem.prefer_unofficial,
+        filesystem.resolution,
+        import_options.display_logo,
+        import_options.chosen_logo,
+        import_options.no_studs,
+        import_options.triangulate,
+        import_options.treat_shortcut_as_model,
+    )
+
+
+# the parsed file for parsed_key, or None if it isn't cached, one of the files it was parsed from has changed
+# or one of the names it references resolves to a different file in this import's search roots,
+# like a part in the folder of the imported model that overrides the library's
+def get_parsed_file(parsed_key):
+    ldraw_file = parsed_file_cache.get(parsed_key)
+    if ldraw_file is None:
+        return None
+
+    if is_changed(ldraw_file):
+        parsed_file_cache.pop(parsed_key, None)
+        return None
+    return ldraw_file
+
+
+def is_changed(ldraw_file):
+    for filepath, mtime in ldraw_file.dependencies.items():
+        try:
+            if filesystem.get_mtime(filepath) != mtime:
+                return True
+        except OSError:
+            return True
+
+    for name, filepath in ldraw_file.resolved_names.items():
+        if filesystem.locate(name, count_missing=False) != filepath:
+            return True
+    return False
+
+
+# the bytes of filepath, which are empty if it couldn't be read
+def read_data(filepath):
+    try:
+        return filesystem.read_bytes(filepath)
+    except Exception as e:
+        print(e)
+        return b''
+
+
+# every line of data, or every line before the one that couldn't be decoded
+def decode_lines(data):
+    lines = []
+    try:
+        with io.TextIOWrapper(io.BytesIO(data), encoding='utf-8') as file:
+            while True:
+                line = file.readline()
+                if not line:
+                    break
+                lines.append(line)
+    except Exception as e:
+        print(e)
+    return lines
+
+
+# a 0 FILE or 0 NOFILE line, from its start to the start of the next line
+# the lines of a file can end in \r\n, \n or \r, the same as when it is read as text
+mpd_command_pattern = re.compile(rb'[ \t\f\v]*0[ \t\f\v]+(?:(NO)FILE|FILE[ \t\f\v]+)([^\r\n]*)(?:\r\n|\r|\n)?')
+
+
+# the 0 FILE and 0 NOFILE lines of data, found without splitting it into lines
+# only the lines FILE is in are matched against mpd_command_pattern
+def find_mpd_commands(data):
+    position = data.find(b'FILE')
+    while position >= 0:
+        line_start = data.rfind(b'\n', 0, position) + 1
+        line_start = max(line_start, data.rfind(b'\r', line_start, position) + 1)
+        match = mpd_command_pattern.match(data, line_start)
+        if match is not None and match.end(2) > position:
+            yield match
+            position = data.find(b'FILE', match.end())
+        else:
+            position = data.find(b'FILE', position + 4)
+
+
+# returns {filename: FileLines} for the bytes of filename, with an entry for every FILE of an MPD,
+# and the name of the MPD's first FILE, which is None if filename isn't an MPD
+# only the FILE and NOFILE lines are looked at, and nothing is decoded until a file's lines are needed
+def index_data(filename, data):
+    files = {}
+    first_mpd_filename = None
+    current_file = None
+    source = FileSource(data)
+    for match in find_mpd_commands(data):
+        if match.group(1) is None:
+            mpd_filename = match.group(2).decode('utf-8', errors='replace').strip().lower()
+            if mpd_filename == "":
+                continue
+
+            if first_mpd_filename is None:
+                first_mpd_filename = mpd_filename
+                # whatever comes before the first FILE is kept under filename, like a file that isn't an MPD
+                if match.start() > 0:
+                    files[filename] = FileLines(source, 0, match.start())
+            elif current_file is not None:
+                current_file.end = match.start()
+                files[current_file.filename] = current_file
+            current_file = FileLines(source, match.end(), len(data), mpd_filename)
+        elif current_file is not None:
+            # the lines after it are skipped until the next FILE
+            current_file.end = match.start()
+            files[current_file.filename] = current_file
+            current_file = None
+
+    if first_mpd_filename is None:
+        files[filename] = FileLines(source, 0, len(data))
+    elif current_file is not None:
+        files[current_file.filename] = current_file
+    source.unread_count = len(files)
+    return files, first_mpd_filename
+
+
+# the FILEs of MPDs that nothing referenced are dropped once the import's files have been parsed,
+# which lets go of the bytes of every MPD whose other FILEs have been read
+def drop_unread_files(import_context):
+    for filename, file_lines in list(import_context.file_lines_cache.items()):
+        if not file_lines.is_read():
+            file_lines.drop()
+            del import_context.file_lines_cache[filename]
+
+
+class FileSource:
+    """
+    The bytes of a file that FileLines are ranges of, and how many of those ranges haven't been read or dropped.
+    The bytes are let go of once none are left.
+    """
+
+    __slots__ = ['data', 'unread_count']
+
+    def __init__(self, data):
+        self.data = data
+        self.unread_count = 0
+
+    def release(self):
+        self.unread_count -= 1
+        if self.unread_count <= 0:
+            self.data = None
+
+
+class FileLines:
+    """
+    The lines of a file, or of one FILE of an MPD, as a range of the bytes of the file they were read from.
+    The range is only decoded the first time lines is used, so the FILEs of an MPD that nothing references
+    are never decoded.
+    """
+
+    __slots__ = ['filename', 'source', 'start', 'end', '_lines']
+
+    def __init__(self, source, start, end, filename=None):
+        self.filename = filename
+        self.source = source
+        self.start = start
+        self.end = end
+        self._lines = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            data = self.source.data
+            if self.start == 0 and self.end == len(data):
+                self._lines = decode_lines(data)
+            else:
+                self._lines = decode_lines(data[self.start:self.end])
+            self.drop()
+        return self._lines
+
+    def is_read(self):
+        return self._lines is not None
+
+    def drop(self):
+        if self.source is not None:
+            self.source.release()
+            self.source = None
+
+
+# filename = "stud-logo.dat"
+# parts = filename.split(".") => ["stud-logo", "dat"]
+# name = parts[0] => "stud-logo"
+# name_parts = name.split('-') => ["stud", "logo"]
+# stud_name = name_parts[0] => "stud"
+# chosen_logo = special_bricks.chosen_logo => "logo5"
+# ext = parts[1] => "dat"
+# filename = f"{stud_name}-{chosen_logo}.{ext}" => "stud-logo5.dat"
+def get_subfile_name(filename):
+    if import_options.display_logo and filename in ldraw_part_types.stud_names:
+        parts = filename.split(".")
+        name = parts[0]
+        name_parts = name.split('-')
+        stud_name = name_parts[0]
+        chosen_logo = import_options.chosen_logo
+        ext = parts[1]
+        filename = f"{stud_name}-{chosen_logo}.{ext}"
+    return filename
+
+
 class LDrawFile:
     def __init__(self, filename):
         self.filepath = None
@@ -73,6 +274,14 @@ class LDrawFile:
 
         self.camera = None
 
+        # False if parsing this file changed state outside of it, like colors, cameras and texmaps,
+        # or if it references something that couldn't be found
+        self.cacheable = True
+        # {filepath: mtime} of this file and every file it references, None if it wasn't read from a filepath
+        self.dependencies = None
+        # {name: filepath} that every name this file and the files it references reference resolved to
+        self.resolved_names = None
+
     def __str__(self):
         return "\n".join([
             f"filename: {self.filename}",
@@ -82,414 +291,406 @@ class LDrawFile:
         ])
 
     @classmethod
-    def get_file(cls, filename):
+    def get_file(cls, import_context, filename):
         filepath = None
-        if filename not in file_lines_cache:
+        parsed_key = None
+        parsed_geometry = None
+        first_mpd_filename = None
+        if filename not in import_context.file_lines_cache:
             # TODO: if missing, use a,b,c,etc parts if available
             filepath = filesystem.locate(filename)
             if filepath is None:
                 return None
 
-            is_mpd = False
-            no_file = False
-            first_mpd_filename = None
-            current_file = None
-            try:
-                with open(filepath, mode='r', encoding='utf-8') as file:
-                    while True:
-                        line = file.readline()
-                        if not line:
-                            break
-
-                        clean_line = helpers.clean_line(line)
-                        strip_line = line.strip()
-
-                        if clean_line == "":
-                            continue
-
-                        if clean_line.startswith("0 FILE "):
-                            if not is_mpd:
-                                is_mpd = True
-
-                            no_file = False
-
-                            mpd_filename = strip_line.split(maxsplit=2)[2].lower()
-                            if first_mpd_filename is None:
-                                first_mpd_filename = mpd_filename
-
-                            if current_file is not None:
-                                file_lines_cache[current_file.filename] = current_file
-                            current_file = LDrawFile(mpd_filename)
-                        elif is_mpd:
-                            if no_file:
-                                continue
-
-                            if clean_line.startswith("0 NOFILE"):
-                                no_file = True
-                                if current_file is not None:
-                                    file_lines_cache[current_file.filename] = current_file
-                                current_file = None
-
-                            elif current_file is not None:
-                                current_file.lines.append(line)
-                        else:
-                            if filename not in file_lines_cache:
-                                file_lines_cache[filename] = LDrawFile(filename)
-                            file_lines_cache[filename].lines.append(line)
-                    if current_file is not None:
-                        file_lines_cache[current_file.filename] = current_file
-            except Exception as e:
-                print(e)
-
-            if first_mpd_filename is not None:
-                filename = first_mpd_filename
+            # a part parsed inside of a texmap has that texmap applied to it
+            if import_context.texmap is None:
+                parsed_key = get_parsed_file_key(filepath)
+                parsed_file = get_parsed_file(parsed_key)
+                if parsed_file is not None:
+                    return parsed_file
+
+            # the file may have been read already by parse_pool, which may have parsed its geometry too,
+            # in which case its lines are only the ones that aren't type 2 to 5 lines
+            lines = import_context.read_ahead_lines.pop(filepath, None)
+            parsed_geometry = import_context.parsed_geometry.pop(filepath, None)
+            data = import_context.read_ahead_data.pop(filepath, None)
+            if parsed_geometry is not None and import_context.texmap is not None:
+                # a part parsed inside of a texmap needs those lines to apply the texmap to
+                parsed_geometry = None
+            if parsed_geometry is None:
+                if data is None and import_context.prefetcher is not None:
+                    data = import_context.prefetcher.get_data(filepath)
+                if data is None:
+                    data = read_data(filepath)
+
+                # lines without their type 2 to 5 lines are left out of file_lines_cache,
+                # so that the file is read again if it is needed again
+                files, first_mpd_filename = index_data(filename, data)
+                import_context.file_lines_cache.update(files)
+
+                if first_mpd_filename is not None:
+                    filename = first_mpd_filename
 
         ldraw_file = LDrawFile(filename)
         ldraw_file.filepath = filepath
-        ldraw_file.lines = file_lines_cache[filename].lines
-        ldraw_file.parse_file()
+        if filepath is not None:
+            ldraw_file.dependencies = {filepath: filesystem.get_mtime(filepath)}
+            ldraw_file.resolved_names = {}
+        if parsed_geometry is not None:
+            ldraw_file.geometry = parsed_geometry
+            ldraw_file.lines = lines
+        else:
+            ldraw_file.lines = import_context.file_lines_cache[filename].lines
+        ldraw_file.parse_file(import_context)
         # print(ldraw_file)
+
+        if parsed_key is not None and first_mpd_filename is None:
+            if ldraw_file.cacheable and not ldraw_file.is_like_model():
+                parsed_file_cache[parsed_key] = ldraw_file
         return ldraw_file
 
     # create meta nodes when those commands affect the scene
     # process meta command in place if it only affects the file
-    def parse_file(self):
-        for line in self.lines:
-            clean_line = helpers.clean_line(line)
-            strip_line = line.strip()
-
-            if clean_line.lower().startswith("0 Name: ".lower()):
-                self.name = strip_line.split(maxsplit=2)[2]
-                continue
-
-            if clean_line.lower().startswith("0 Author: ".lower()):
-                self.author = strip_line.split(maxsplit=2)[2]
-                continue
-
-            if clean_line.startswith("0 !LDRAW_ORG "):
-                self.actual_part_type = strip_line.split(maxsplit=2)[2].lower()
-                self.part_type = LDrawFile.determine_part_type(self.actual_part_type)
-                continue
-
-            if clean_line.startswith("0 LDRAW_ORG "):
-                self.actual_part_type = strip_line.split(maxsplit=2)[2].lower()
-                self.part_type = LDrawFile.determine_part_type(self.actual_part_type)
-                continue
-
-            if clean_line.startswith("0 Official LCAD "):
-                self.actual_part_type = strip_line.split(maxsplit=3)[3].lower()
-                self.part_type = LDrawFile.determine_part_type(self.actual_part_type)
-                continue
-
-            if clean_line.startswith("0 Unofficial "):
-                self.actual_part_type = strip_line.split(maxsplit=2)[2].lower()
-                self.part_type = LDrawFile.determine_part_type(self.actual_part_type)
-                continue
-
-            if clean_line.startswith("0 Un-official "):
-                self.actual_part_type = strip_line.split(maxsplit=2)[2].lower()
-                self.part_type = LDrawFile.determine_part_type(self.actual_part_type)
-                continue
-
-            if clean_line.startswith("0 !COLOUR "):
-                _params = helpers.get_params(clean_line, "0 !COLOUR ", lowercase=False)
-                ldraw_colors.parse_color(_params)
-                continue
-
-            if clean_line.startswith("0 STEP"):
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "step"
-                self.child_nodes.append(ldraw_node)
-                continue
-
-            if clean_line.startswith("0 SAVE"):
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "save"
-                self.child_nodes.append(ldraw_node)
-                continue
-
-            if clean_line.startswith("0 CLEAR"):
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "clear"
-                self.child_nodes.append(ldraw_node)
-                continue
-
-            if clean_line in ["0 PRINT", "0 WRITE"]:
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "print"
-                ldraw_node.meta_args["message"] = clean_line.split(maxsplit=2)[2]
-                self.child_nodes.append(ldraw_node)
-                continue
-
-            if clean_line.startswith("0 !LDCAD GROUP_DEF "):
-                # http://www.melkert.net/LDCad/tech/meta
-                _params = re.search(r"\S+\s+\S+\s+\S+\s+(\[.*\])\s+(\[.*\])\s+(\[.*\])\s+(\[.*\])\s+(\[.*\])", clean_line)
-
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "group_def"
+    # lines are routed by their first token, and 0 lines by their second token through meta_handlers,
+    # so geometry lines, which are most of the lines in a part, don't have to get past every meta command check
+    def parse_file(self, import_context):
+        if import_context.prefetcher is not None:
+            import_context.prefetcher.queue_subfiles(import_context, self.lines)
 
-                id_args = re.search(r"\[(.*)=(.*)\]", _params[2])
-                ldraw_node.meta_args["id"] = id_args[2]
+        self.parse_lines(import_context)
 
-                name_args = re.search(r"\[(.*)=(.*)\]", _params[4])
-                ldraw_node.meta_args["name"] = name_args[2]
+        self.geometry.finalize(import_options.triangulate)
+        if self.extra_geometry is not None:
+            self.extra_geometry.finalize(import_options.triangulate)
 
-                self.child_nodes.append(ldraw_node)
-                continue
-
-            if clean_line.startswith("0 !LDCAD GROUP_NXT "):
-                _params = re.search(r"\S+\s+\S+\s+\S+\s+(\[.*\])\s+(\[.*\])", clean_line)
-
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "group_nxt"
-
-                id_args = re.search(r"\[(.*)=(.*)\]", _params[1])
-                ldraw_node.meta_args["id"] = id_args[2]
-
-                self.child_nodes.append(ldraw_node)
-                continue
+        if self.extra_geometry is not None or self.extra_child_nodes is not None:
+            _key = []
+            _key.append(self.filename)
+            _key.append("extra")
+            if import_context.texmap is not None:
+                _key.append(import_context.texmap.id)
+            _key = "_".join([str(k).lower() for k in _key])
 
-            if clean_line.startswith("0 !LEOCAD GROUP BEGIN "):
-                # https://www.leocad.org/docs/meta.html
-                name_args = clean_line.split(maxsplit=4)
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "group_begin"
-                ldraw_node.meta_args["name"] = name_args[4]
-                self.child_nodes.append(ldraw_node)
-                continue
+            if _key not in import_context.key_map:
+                import_context.key_map[_key] = str(uuid.uuid4())
+            key = import_context.key_map[_key]
 
-            if clean_line.startswith("0 !LEOCAD GROUP END"):
-                ldraw_node = LDrawNode()
-                ldraw_node.line = clean_line
-                ldraw_node.meta_command = "group_end"
-                self.child_nodes.append(ldraw_node)
-                continue
+            if key not in import_context.file_cache:
+                filename = f"{self.name}_extra"
+                ldraw_file = LDrawFile(filename)
+                ldraw_file.part_type = "part"
+                ldraw_file.child_nodes = (self.extra_child_nodes or [])
+                ldraw_file.geometry = (self.extra_geometry or LDrawGeometry())
+                import_context.file_cache[key] = ldraw_file
+            ldraw_file = import_context.file_cache[key]
+            ldraw_node = LDrawNode()
+            ldraw_node.line = ""
+            ldraw_node.file = ldraw_file
+            self.child_nodes.append(ldraw_node)
 
-            if clean_line.startswith("0 !LEOCAD CAMERA "):
-                _params = helpers.get_params(clean_line, "0 !LEOCAD CAMERA ")
-                if self.camera is None:
-                    self.camera = ldraw_camera.LDrawCamera()
-
-                # https://www.leocad.org/docs/meta.html
-                # "Camera commands can be grouped in the same line"
-                # _params = _params[1:] at the end bumps promotes _params[2] to _params[1]
-                while len(_params) > 0:
-                    if _params[0] == "fov":
-                        self.camera.fov = float(_params[1])
-                        _params = _params[2:]
-                    elif _params[0] == "znear":
-                        self.camera.z_near = float(_params[1])
-                        _params = _params[2:]
-                    elif _params[0] == "zfar":
-                        self.camera.z_far = float(_params[1])
-                        _params = _params[2:]
-                    elif _params[0] in ["position", "target_position", "up_vector"]:
-                        (x, y, z) = map(float, _params[1:4])
-                        vector = mathutils.Vector((x, y, z))
-
-                        if _params[0] == "position":
-                            self.camera.position = vector
-
-                        elif _params[0] == "target_position":
-                            self.camera.target_position = vector
-
-                        elif _params[0] == "up_vector":
-                            self.camera.up_vector = vector
-
-                        _params = _params[4:]
-
-                    elif _params[0] == "orthographic":
-                        self.camera.orthographic = True
-                        _params = _params[1:]
-                    elif _params[0] == "hidden":
-                        self.camera.hidden = True
-                        _params = _params[1:]
-                    elif _params[0] == "name":
-                        # "0 !LEOCAD CAMERA NAME Camera  2".split("NAME ")[1] => "Camera  2"
-                        # "NAME Camera  2".split("NAME ")[1] => "Camera  2"
-                        name_args = clean_line.split("NAME ")
-                        self.camera.name = name_args[1]
-
-                        # By definition this is the last of the parameters
-                        _params = []
-
-                        ldraw_camera.cameras.append(self.camera)
-                        self.camera = None
-                    else:
-                        _params = _params[1:]
+    # every line, routed by its first token, and a 0 line by its second token
+    def parse_lines(self, import_context):
+        for line in self.lines:
+            clean_line = helpers.clean_line(line)
+            if clean_line == "":
                 continue
 
-            if clean_line.startswith("0 !TEXMAP "):
-                # https://www.ldraw.org/documentation/ldraw-org-file-format-standards/language-extension-for-texture-mapping.html
-                _params = helpers.get_params(clean_line, "0 !TEXMAP ")
+            _params = clean_line.split(maxsplit=2)
+            line_type = _params[0]
 
+            if line_type in geometry_line_types:
                 if self.texmap_start:
-                    if _params[0].lower() in ["fallback"]:
-                        self.texmap_fallback = True
-                    elif _params[0].lower() in ["end"]:
-                        self.set_texmap_end()
-                elif _params[0].lower() in ["start", "next"]:
-                    if _params[0].lower() == "start":
-                        self.texmap_start = True
-                    elif _params[0].lower() == "next":
-                        self.texmap_next = True
-                    self.texmap_fallback = False
-
-                    new_texmap = None
-                    method = _params[1].lower()
-                    if method in ['planar']:
-                        _params = clean_line[len("0 !TEXMAP "):].split(maxsplit=11)  # planar
-
-                        (x1, y1, z1, x2, y2, z2, x3, y3, z3) = map(float, _params[2:11])
-
-                        texture_params = helpers.parse_csv_line(_params[11], 2)
-                        texture = texture_params[0]
-                        glossmap = texture_params[1]
-
-                        new_texmap = TexMap(
-                            method=method,
-                            parameters=[
-                                mathutils.Vector((x1, y1, z1)),
-                                mathutils.Vector((x2, y2, z2)),
-                                mathutils.Vector((x3, y3, z3)),
-                            ],
-                            texture=texture,
-                            glossmap=glossmap,
-                        )
-                    elif method in ['cylindrical']:
-                        _params = clean_line[len("0 !TEXMAP "):].split(maxsplit=12)  # cylindrical
-
-                        (x1, y1, z1, x2, y2, z2, x3, y3, z3, a) = map(float, _params[2:12])
-
-                        texture_params = helpers.parse_csv_line(_params[12], 2)
-                        texture = texture_params[0]
-                        glossmap = texture_params[1]
-
-                        new_texmap = TexMap(
-                            method=method,
-                            parameters=[
-                                mathutils.Vector((x1, y1, z1)),
-                                mathutils.Vector((x2, y2, z2)),
-                                mathutils.Vector((x3, y3, z3)),
-                                a,
-                            ],
-                            texture=texture,
-                            glossmap=glossmap,
-                        )
-                    elif method in ['spherical']:
-                        _params = clean_line[len("0 !TEXMAP "):].split(maxsplit=13)  # spherical
-
-                        (x1, y1, z1, x2, y2, z2, x3, y3, z3, a, b) = map(float, _params[2:13])
-
-                        texture_params = helpers.parse_csv_line(_params[13], 2)
-                        texture = texture_params[0]
-                        glossmap = texture_params[1]
-
-                        new_texmap = TexMap(
-                            method=method,
-                            parameters=[
-                                mathutils.Vector((x1, y1, z1)),
-                                mathutils.Vector((x2, y2, z2)),
-                                mathutils.Vector((x3, y3, z3)),
-                                a,
-                                b,
-                            ],
-                            texture=texture,
-                            glossmap=glossmap,
-                        )
-
-                    if new_texmap is not None:
-                        if texmap.texmap is not None:
-                            texmap.texmaps.append(texmap.texmap)
-                        texmap.texmap = new_texmap
+                    self.parse_geometry_line(import_context, clean_line)
+                    if self.texmap_next:
+                        self.set_texmap_end(import_context)
+                elif not self.texmap_fallback:
+                    self.parse_geometry_line(import_context, clean_line)
                 continue
 
+            if line_type == "0" and len(_params) > 1:
+                handler = meta_handlers.get(_params[1])
+                if handler is None:
+                    handler = lowercase_meta_handlers.get(_params[1].lower())
+                if handler is not None and handler(self, import_context, line, clean_line, _params):
+                    continue
+
             if self.texmap_start:
                 if clean_line.startswith('0 !: '):
                     # remove 0 !: from line so that it can be parsed like a normal line
                     _clean_line = clean_line[len('0 !: '):].strip()
-                    self.parse_geometry_line(_clean_line)
-                else:
-                    self.parse_geometry_line(clean_line)
+                    self.parse_geometry_line(import_context, _clean_line)
 
                 if self.texmap_next:
-                    self.set_texmap_end()
-                continue
-
-            if not self.texmap_fallback and self.parse_geometry_line(clean_line):
+                    self.set_texmap_end(import_context)
                 continue
 
             # this goes last so that description will be properly detected
-            if clean_line.startswith("0"):
+            if line_type == "0":
                 if self.texmap_next:
                     # if 0 line and texmap next, error
                     # also error
                     continue
                 if clean_line.startswith("0 //"):
                     continue
-                if self.description is None:
+                if self.description is None and len(_params) > 1:
                     self.description = clean_line.split(maxsplit=1)[1]
                 continue
 
-        if self.extra_geometry is not None or self.extra_child_nodes is not None:
-            _key = []
-            _key.append(self.filename)
-            _key.append("extra")
-            if texmap.texmap is not None:
-                _key.append(texmap.texmap.id)
-            _key = "_".join([str(k).lower() for k in _key])
+    # meta command handlers
+    # each one gets the import context, the raw line, the clean line and the clean line split into at most 3 parts
+    # and returns False if the line isn't the command after all, so that it is treated like any other 0 line
+
+    def parse_name(self, import_context, line, clean_line, _params):
+        if len(_params) < 3:
+            return False
+        self.name = line.strip().split(maxsplit=2)[2]
+        return True
+
+    def parse_author(self, import_context, line, clean_line, _params):
+        if len(_params) < 3:
+            return False
+        self.author = line.strip().split(maxsplit=2)[2]
+        return True
+
+    # 0 !LDRAW_ORG, 0 LDRAW_ORG, 0 Unofficial, 0 Un-official, 0 Official LCAD
+    def parse_part_type(self, import_context, line, clean_line, _params):
+        actual_part_type = ldraw_part_types.get_actual_part_type(line)
+        if actual_part_type is None:
+            return False
+        self.actual_part_type = actual_part_type
+        self.part_type = ldraw_part_types.determine_part_type(self.actual_part_type)
+        return True
+
+    def parse_colour(self, import_context, line, clean_line, _params):
+        if len(_params) < 3:
+            return False
+        self.cacheable = False
+        _params = helpers.get_params(clean_line, "0 !COLOUR ", lowercase=False)
+        ldraw_colors.parse_color(_params)
+        return True
+
+    def parse_step(self, import_context, line, clean_line, _params):
+        self.add_meta_node(clean_line, "step")
+        return True
+
+    def parse_save(self, import_context, line, clean_line, _params):
+        self.add_meta_node(clean_line, "save")
+        return True
+
+    def parse_clear(self, import_context, line, clean_line, _params):
+        self.add_meta_node(clean_line, "clear")
+        return True
+
+    # 0 PRINT, 0 WRITE
+    def parse_print(self, import_context, line, clean_line, _params):
+        ldraw_node = self.add_meta_node(clean_line, "print")
+        ldraw_node.meta_args["message"] = _params[2] if len(_params) > 2 else ""
+        return True
+
+    def add_meta_node(self, clean_line, meta_command):
+        ldraw_node = LDrawNode()
+        ldraw_node.line = clean_line
+        ldraw_node.meta_command = meta_command
+        self.child_nodes.append(ldraw_node)
+        return ldraw_node
+
+    def parse_ldcad(self, import_context, line, clean_line, _params):
+        if clean_line.startswith("0 !LDCAD GROUP_DEF "):
+            # http://www.melkert.net/LDCad/tech/meta
+            _params = re.search(r"\S+\s+\S+\s+\S+\s+(\[.*\])\s+(\[.*\])\s+(\[.*\])\s+(\[.*\])\s+(\[.*\])", clean_line)
+
+            ldraw_node = self.add_meta_node(clean_line, "group_def")
+
+            id_args = re.search(r"\[(.*)=(.*)\]", _params[2])
+            ldraw_node.meta_args["id"] = id_args[2]
+
+            name_args = re.search(r"\[(.*)=(.*)\]", _params[4])
+            ldraw_node.meta_args["name"] = name_args[2]
+            return True
 
-            if _key not in key_map:
-                key_map[_key] = str(uuid.uuid4())
-            key = key_map[_key]
+        if clean_line.startswith("0 !LDCAD GROUP_NXT "):
+            _params = re.search(r"\S+\s+\S+\s+\S+\s+(\[.*\])\s+(\[.*\])", clean_line)
 
-            if key not in file_cache:
-                filename = f"{self.name}_extra"
-                ldraw_file = LDrawFile(filename)
-                ldraw_file.part_type = "part"
-                ldraw_file.child_nodes = (self.extra_child_nodes or [])
-                ldraw_file.geometry = (self.extra_geometry or LDrawGeometry())
-                file_cache[key] = ldraw_file
-            ldraw_file = file_cache[key]
-            ldraw_node = LDrawNode()
-            ldraw_node.line = ""
-            ldraw_node.file = ldraw_file
-            self.child_nodes.append(ldraw_node)
+            ldraw_node = self.add_meta_node(clean_line, "group_nxt")
+
+            id_args = re.search(r"\[(.*)=(.*)\]", _params[1])
+            ldraw_node.meta_args["id"] = id_args[2]
+            return True
+
+        return False
+
+    def parse_leocad(self, import_context, line, clean_line, _params):
+        if clean_line.startswith("0 !LEOCAD GROUP BEGIN "):
+            # https://www.leocad.org/docs/meta.html
+            name_args = clean_line.split(maxsplit=4)
+            ldraw_node = self.add_meta_node(clean_line, "group_begin")
+            ldraw_node.meta_args["name"] = name_args[4]
+            return True
+
+        if clean_line.startswith("0 !LEOCAD GROUP END"):
+            self.add_meta_node(clean_line, "group_end")
+            return True
+
+        if clean_line.startswith("0 !LEOCAD CAMERA "):
+            self.cacheable = False
+            _params = helpers.get_params(clean_line, "0 !LEOCAD CAMERA ")
+            if self.camera is None:
+                self.camera = ldraw_camera.LDrawCamera()
+
+            # https://www.leocad.org/docs/meta.html
+            # "Camera commands can be grouped in the same line"
+            # _params = _params[1:] at the end bumps promotes _params[2] to _params[1]
+            while len(_params) > 0:
+                if _params[0] == "fov":
+                    self.camera.fov = float(_params[1])
+                    _params = _params[2:]
+                elif _params[0] == "znear":
+                    self.camera.z_near = float(_params[1])
+                    _params = _params[2:]
+                elif _params[0] == "zfar":
+                    self.camera.z_far = float(_params[1])
+                    _params = _params[2:]
+                elif _params[0] in ["position", "target_position", "up_vector"]:
+                    (x, y, z) = map(float, _params[1:4])
+                    vector = mathutils.Vector((x, y, z))
+
+                    if _params[0] == "position":
+                        self.camera.position = vector
+
+                    elif _params[0] == "target_position":
+                        self.camera.target_position = vector
+
+                    elif _params[0] == "up_vector":
+                        self.camera.up_vector = vector
+
+                    _params = _params[4:]
+
+                elif _params[0] == "orthographic":
+                    self.camera.orthographic = True
+                    _params = _params[1:]
+                elif _params[0] == "hidden":
+                    self.camera.hidden = True
+                    _params = _params[1:]
+                elif _params[0] == "name":
+                    # "0 !LEOCAD CAMERA NAME Camera  2".split("NAME ")[1] => "Camera  2"
+                    # "NAME Camera  2".split("NAME ")[1] => "Camera  2"
+                    name_args = clean_line.split("NAME ")
+                    self.camera.name = name_args[1]
+
+                    # By definition this is the last of the parameters
+                    _params = []
+
+                    import_context.cameras.append(self.camera)
+                    self.camera = None
+                else:
+                    _params = _params[1:]
+            return True
+
+        return False
+
+    def parse_texmap(self, import_context, line, clean_line, _params):
+        if len(_params) < 3:
+            return False
+        self.cacheable = False
+        # https://www.ldraw.org/documentation/ldraw-org-file-format-standards/language-extension-for-texture-mapping.html
+        _params = helpers.get_params(clean_line, "0 !TEXMAP ")
+
+        if self.texmap_start:
+            if _params[0].lower() in ["fallback"]:
+                self.texmap_fallback = True
+            elif _params[0].lower() in ["end"]:
+                self.set_texmap_end(import_context)
+        elif _params[0].lower() in ["start", "next"]:
+            if _params[0].lower() == "start":
+                self.texmap_start = True
+            elif _params[0].lower() == "next":
+                self.texmap_next = True
+            self.texmap_fallback = False
+
+            new_texmap = None
+            method = _params[1].lower()
+            if method in ['planar']:
+                _params = clean_line[len("0 !TEXMAP "):].split(maxsplit=11)  # planar
+
+                (x1, y1, z1, x2, y2, z2, x3, y3, z3) = map(float, _params[2:11])
+
+                texture_params = helpers.parse_csv_line(_params[11], 2)
+                texture = texture_params[0]
+                glossmap = texture_params[1]
+
+                new_texmap = TexMap(
+                    method=method,
+                    parameters=[
+                        mathutils.Vector((x1, y1, z1)),
+                        mathutils.Vector((x2, y2, z2)),
+                        mathutils.Vector((x3, y3, z3)),
+                    ],
+                    texture=texture,
+                    glossmap=glossmap,
+                )
+            elif method in ['cylindrical']:
+                _params = clean_line[len("0 !TEXMAP "):].split(maxsplit=12)  # cylindrical
+
+                (x1, y1, z1, x2, y2, z2, x3, y3, z3, a) = map(float, _params[2:12])
+
+                texture_params = helpers.parse_csv_line(_params[12], 2)
+                texture = texture_params[0]
+                glossmap = texture_params[1]
+
+                new_texmap = TexMap(
+                    method=method,
+                    parameters=[
+                        mathutils.Vector((x1, y1, z1)),
+                        mathutils.Vector((x2, y2, z2)),
+                        mathutils.Vector((x3, y3, z3)),
+                        a,
+                    ],
+                    texture=texture,
+                    glossmap=glossmap,
+                )
+            elif method in ['spherical']:
+                _params = clean_line[len("0 !TEXMAP "):].split(maxsplit=13)  # spherical
+
+                (x1, y1, z1, x2, y2, z2, x3, y3, z3, a, b) = map(float, _params[2:13])
+
+                texture_params = helpers.parse_csv_line(_params[13], 2)
+                texture = texture_params[0]
+                glossmap = texture_params[1]
+
+                new_texmap = TexMap(
+                    method=method,
+                    parameters=[
+                        mathutils.Vector((x1, y1, z1)),
+                        mathutils.Vector((x2, y2, z2)),
+                        mathutils.Vector((x3, y3, z3)),
+                        a,
+                        b,
+                    ],
+                    texture=texture,
+                    glossmap=glossmap,
+                )
+
+            if new_texmap is not None:
+                if import_context.texmap is not None:
+                    import_context.texmaps.append(import_context.texmap)
+                import_context.texmap = new_texmap
+        return True
 
     # if there's a line type specified, determine what that type is
     @classmethod
     def determine_part_type(cls, actual_part_type):
-        if "primitive" in actual_part_type:
-            return "primitive"
-        elif "subpart" in actual_part_type:
-            return "subpart"
-        elif "part" in actual_part_type:
-            return "part"
-        elif "shortcut" in actual_part_type:
-            return "shortcut"
-        elif "model" in actual_part_type:
-            return "model"
-        elif "configuration" in actual_part_type:
-            return "configuration"
-        return "part"
-
-    def set_texmap_end(self):
-        if len(texmap.texmaps) < 1:
-            texmap.texmap = None
+        return ldraw_part_types.determine_part_type(actual_part_type)
+
+    def set_texmap_end(self, import_context):
+        if len(import_context.texmaps) < 1:
+            import_context.texmap = None
         else:
-            texmap.texmap = texmap.texmaps.pop()
+            import_context.texmap = import_context.texmaps.pop()
         self.texmap_start = False
         self.texmap_next = False
         self.texmap_fallback = False
 
-    def parse_geometry_line(self, clean_line):
+    def parse_geometry_line(self, import_context, clean_line):
         _params = clean_line.split(maxsplit=14)
         if _params[0] == "1":
             color_code = _params[1]
@@ -502,41 +703,35 @@ class LDrawFile:
                 (0, 0, 0, 1)
             ))
 
-            filename = _params[14].lower()
-
-            # filename = "stud-logo.dat"
-            # parts = filename.split(".") => ["stud-logo", "dat"]
-            # name = parts[0] => "stud-logo"
-            # name_parts = name.split('-') => ["stud", "logo"]
-            # stud_name = name_parts[0] => "stud"
-            # chosen_logo = special_bricks.chosen_logo => "logo5"
-            # ext = parts[1] => "dat"
-            # filename = f"{stud_name}-{chosen_logo}.{ext}" => "stud-logo5.dat"
-            if import_options.display_logo and filename in ldraw_part_types.stud_names:
-                parts = filename.split(".")
-                name = parts[0]
-                name_parts = name.split('-')
-                stud_name = name_parts[0]
-                chosen_logo = import_options.chosen_logo
-                ext = parts[1]
-                filename = f"{stud_name}-{chosen_logo}.{ext}"
+            filename = get_subfile_name(_params[14].lower())
 
             _key = []
             _key.append(filename)
-            if texmap.texmap is not None:
-                _key.append(texmap.texmap.id)
+            if import_context.texmap is not None:
+                _key.append(import_context.texmap.id)
             _key = "_".join([str(k).lower() for k in _key])
 
-            if _key not in key_map:
-                key_map[_key] = str(uuid.uuid4())
-            key = key_map[_key]
+            if _key not in import_context.key_map:
+                import_context.key_map[_key] = str(uuid.uuid4())
+            key = import_context.key_map[_key]
 
-            if key not in file_cache:
-                ldraw_file = LDrawFile.get_file(filename)
+            if key not in import_context.file_cache:
+                ldraw_file = LDrawFile.get_file(import_context, filename)
                 if ldraw_file is None:
+                    self.cacheable = False
                     return True
-                file_cache[key] = ldraw_file
-            ldraw_file = file_cache[key]
+                import_context.file_cache[key] = ldraw_file
+            ldraw_file = import_context.file_cache[key]
+
+            if not ldraw_file.cacheable:
+                self.cacheable = False
+            elif ldraw_file.dependencies is None:
+                # like a FILE of an MPD, it can't be told whether it has changed
+                self.cacheable = False
+            elif self.dependencies is not None:
+                self.dependencies.update(ldraw_file.dependencies)
+                self.resolved_names[filename] = ldraw_file.filepath
+                self.resolved_names.update(ldraw_file.resolved_names)
 
             if import_options.no_studs and ldraw_file.is_like_stud():
                 return True
@@ -563,18 +758,17 @@ class LDrawFile:
             if self.is_like_model():
                 if self.extra_geometry is None:
                     self.extra_geometry = LDrawGeometry()
-                self.extra_geometry.parse_face(_params, texmap.texmap)
+                self.extra_geometry.parse_face(_params, import_context.texmap)
             else:
-                self.geometry.parse_face(_params, texmap.texmap)
+                self.geometry.parse_face(_params, import_context.texmap)
             return True
         return False
 
     def is_configuration(self):
         return self.part_type in ldraw_part_types.configuration_types
 
-    # this allows shortcuts to be split into their individual parts if desired
     def is_like_model(self):
-        return self.is_model() or (import_options.treat_shortcut_as_model and self.is_shortcut())
+        return ldraw_part_types.is_like_model(self.part_type, import_options.treat_shortcut_as_model)
 
     def is_model(self):
         return self.part_type in ldraw_part_types.model_types
@@ -602,3 +796,30 @@ class LDrawFile:
 
     def is_logo(self):
         return self.name in ldraw_part_types.logo_names
+
+
+geometry_line_types = {"1", "2", "3", "4", "5"}
+
+# {second token of a 0 line: handler}
+meta_handlers = {
+    "!LDRAW_ORG": LDrawFile.parse_part_type,
+    "LDRAW_ORG": LDrawFile.parse_part_type,
+    "Official": LDrawFile.parse_part_type,
+    "Unofficial": LDrawFile.parse_part_type,
+    "Un-official": LDrawFile.parse_part_type,
+    "!COLOUR": LDrawFile.parse_colour,
+    "STEP": LDrawFile.parse_step,
+    "SAVE": LDrawFile.parse_save,
+    "CLEAR": LDrawFile.parse_clear,
+    "PRINT": LDrawFile.parse_print,
+    "WRITE": LDrawFile.parse_print,
+    "!LDCAD": LDrawFile.parse_ldcad,
+    "!LEOCAD": LDrawFile.parse_leocad,
+    "!TEXMAP": LDrawFile.parse_texmap,
+}
+
+# 0 Name: and 0 Author: are matched regardless of case
+lowercase_meta_handlers = {
+    "name:": LDrawFile.parse_name,
+    "author:": LDrawFile.parse_author,
+}
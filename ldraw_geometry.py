@@ -1,71 +1,219 @@
-import mathutils
+import numpy as np
 
-from . import import_options
+# this module doesn't import the rest of the addon, so that parse_pool's worker processes can run it on its own
 
+# how many vertices of each line type are used
+vert_counts = {"2": 2, "3": 3, "4": 4, "5": 2}
 
-class FaceInfo:
+
+class FaceArrays:
     """
-    A file's face information. The raw model data before any transforms.
+    One kind of line of a file packed end to end. The raw model data before any transforms.
+
+    Face i is vertices[offsets[i]:offsets[i + 1]], its color code is color_codes[colors[i]]
+    and its texmap is texmaps[texmap_indexes[i]], or None if that is -1.
     """
 
-    def __init__(self, color_code, vertices, texmap=None):
-        self.color_code = color_code
+    def __init__(self, vertices, offsets, colors, texmap_indexes, color_codes, texmaps):
         self.vertices = vertices
-        self.texmap = texmap
+        self.offsets = offsets
+        self.colors = colors
+        self.texmap_indexes = texmap_indexes
+        self.color_codes = color_codes
+        self.texmaps = texmaps
+
+    def __len__(self):
+        return len(self.colors)
+
+    @classmethod
+    def empty(cls, color_codes, texmaps):
+        return cls(
+            np.empty((0, 3), dtype=np.float64),
+            np.zeros(1, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int32),
+            color_codes,
+            texmaps,
+        )
+
+    def get_texmap(self, index):
+        texmap_index = self.texmap_indexes[index]
+        if texmap_index < 0:
+            return None
+        return self.texmaps[texmap_index]
+
+
+class PendingLines:
+    """
+    The unconverted numbers of every line of one kind, gathered by parse_face.
+    """
+
+    def __init__(self):
+        self.coords = []
+        self.colors = []
+        self.sizes = []
+        self.texmaps = []
 
 
 class LDrawGeometry:
     """
     A file's geometry information.
+
+    parse_face only gathers each line's numbers and finalize converts all of them at once into
+    edges, faces and lines.
     """
 
     def __init__(self):
-        self.edge_infos = []
-        self.face_infos = []
-        self.line_infos = []
         self.edge_vert_count = 0
         self.face_vert_count = 0
         self.line_vert_count = 0
 
+        self.color_codes = []
+        self.color_indexes = {}
+        self.texmaps = []
+        self.texmap_indexes = {}
+
+        self.edges = FaceArrays.empty(self.color_codes, self.texmaps)
+        self.faces = FaceArrays.empty(self.color_codes, self.texmaps)
+        self.lines = FaceArrays.empty(self.color_codes, self.texmaps)
+
+        self.pending_edges = PendingLines()
+        self.pending_faces = PendingLines()
+        self.pending_lines = PendingLines()
+
     def parse_face(self, _params, texmap=None):
         line_type = _params[0]
 
-        color_code = _params[1]
+        vert_count = vert_counts.get(line_type)
+        if vert_count is None:
+            return
+
+        coord_count = vert_count * 3
+        if len(_params) < coord_count + 2:
+            return
 
         if line_type == "2":
-            vert_count = 2
-        elif line_type == "3":
-            vert_count = 3
-        elif line_type == "4":
-            vert_count = 4
+            pending = self.pending_edges
         elif line_type == "5":
-            vert_count = 2
+            pending = self.pending_lines
         else:
-            return
+            pending = self.pending_faces
+        pending.sizes.append(vert_count)
+        pending.texmaps.append(-1 if texmap is None else self.get_texmap_index(texmap))
+        pending.coords.extend(_params[2:coord_count + 2])
+        pending.colors.append(self.get_color_index(_params[1]))
 
-        verts = []
-        for i in range(vert_count):
-            x = float(_params[i * 3 + 2])
-            y = float(_params[i * 3 + 3])
-            z = float(_params[i * 3 + 4])
-            vertex = mathutils.Vector((x, y, z))
-            verts.append(vertex)
+    def get_color_index(self, color_code):
+        color_index = self.color_indexes.get(color_code)
+        if color_index is None:
+            color_index = len(self.color_codes)
+            self.color_indexes[color_code] = color_index
+            self.color_codes.append(color_code)
+        return color_index
 
-        if line_type == "2":
-            self.edge_vert_count += len(verts)
-            self.edge_infos.append(FaceInfo(color_code, verts))
-        elif line_type == "3":
-            self.face_vert_count += len(verts)
-            self.face_infos.append(FaceInfo(color_code, verts, texmap=texmap))
-        elif line_type == "4":
-            self.face_vert_count += len(verts)
-            if import_options.triangulate:
-                verts1 = [verts[0], verts[1], verts[2]]
-                self.face_infos.append(FaceInfo(color_code, verts1, texmap=texmap))
-                verts2 = [verts[2], verts[3], verts[0]]
-                self.face_infos.append(FaceInfo(color_code, verts2, texmap=texmap))
-            else:
-                self.face_infos.append(FaceInfo(color_code, verts, texmap=texmap))
-        elif line_type == "5":
-            self.line_vert_count += len(verts)
-            self.line_infos.append(FaceInfo(color_code, verts))
+    def get_texmap_index(self, texmap):
+        texmap_index = self.texmap_indexes.get(id(texmap))
+        if texmap_index is None:
+            texmap_index = len(self.texmaps)
+            self.texmap_indexes[id(texmap)] = texmap_index
+            self.texmaps.append(texmap)
+        return texmap_index
+
+    # called once the file has been read
+    def finalize(self, triangulate):
+        if len(self.pending_edges.colors) > 0:
+            self.edges = self.convert(self.pending_edges)
+        if len(self.pending_faces.colors) > 0:
+            self.faces = self.convert(self.pending_faces)
+            if triangulate:
+                self.faces = self.triangulate(self.faces)
+        if len(self.pending_lines.colors) > 0:
+            self.lines = self.convert(self.pending_lines)
+
+        self.pending_edges = PendingLines()
+        self.pending_faces = PendingLines()
+        self.pending_lines = PendingLines()
+
+        self.update_vert_counts()
+
+    def update_vert_counts(self):
+        self.edge_vert_count = len(self.edges.vertices)
+        self.face_vert_count = len(self.faces.vertices)
+        self.line_vert_count = len(self.lines.vertices)
+
+    # the finalized geometry as plain lists and arrays, so that it can be sent between processes
+    # without either side having to unpickle the other's classes
+    # geometry with texmaps isn't sent, so they aren't included
+    def get_arrays(self):
+        return list(self.color_codes), [
+            (face_arrays.vertices, face_arrays.offsets, face_arrays.colors)
+            for face_arrays in (self.edges, self.faces, self.lines)
+        ]
+
+    @classmethod
+    def from_arrays(cls, color_codes, arrays):
+        geometry = cls()
+        for color_code in color_codes:
+            geometry.get_color_index(color_code)
+
+        geometry.edges, geometry.faces, geometry.lines = [
+            FaceArrays(vertices, offsets, colors, np.full(len(colors), -1, dtype=np.int32), geometry.color_codes, geometry.texmaps)
+            for vertices, offsets, colors in arrays
+        ]
+        geometry.update_vert_counts()
+        return geometry
+
+    # one conversion for every number of every line of this kind
+    # if any number is malformed, fall back to converting line by line and skip the bad lines
+    def convert(self, pending):
+        try:
+            vertices = np.array(pending.coords, dtype=np.float64).reshape(-1, 3)
+        except ValueError:
+            rows = []
+            keep = []
+            start = 0
+            for i, size in enumerate(pending.sizes):
+                end = start + size * 3
+                try:
+                    rows.extend([float(c) for c in pending.coords[start:end]])
+                    keep.append(i)
+                except ValueError:
+                    print(f"malformed line {' '.join(pending.coords[start:end])}")
+                start = end
+            vertices = np.array(rows, dtype=np.float64).reshape(-1, 3)
+            pending.sizes = [pending.sizes[i] for i in keep]
+            pending.colors = [pending.colors[i] for i in keep]
+            pending.texmaps = [pending.texmaps[i] for i in keep]
+
+        offsets = np.zeros(len(pending.sizes) + 1, dtype=np.int32)
+        np.cumsum(pending.sizes, out=offsets[1:])
+        return FaceArrays(
+            vertices,
+            offsets,
+            np.array(pending.colors, dtype=np.int32),
+            np.array(pending.texmaps, dtype=np.int32),
+            self.color_codes,
+            self.texmaps,
+        )
+
+    # quad a b c d => triangles a b c and c d a, in the same place as the quad
+    @staticmethod
+    def triangulate(faces):
+        sizes = np.diff(faces.offsets)
+        if not np.any(sizes == 4):
+            return faces
+
+        counts = sizes - 2
+        sources = np.repeat(np.arange(len(sizes)), counts)
+        second = np.zeros(len(sources), dtype=bool)
+        second[np.cumsum(counts)[sizes == 4] - 1] = True
+        corners = faces.offsets[:-1][sources][:, None] + np.where(second[:, None], [2, 3, 0], [0, 1, 2])
+
+        return FaceArrays(
+            faces.vertices[corners.ravel()],
+            np.arange(0, len(sources) * 3 + 1, 3, dtype=np.int32),
+            faces.colors[sources],
+            faces.texmap_indexes[sources],
+            faces.color_codes,
+            faces.texmaps,
+        )
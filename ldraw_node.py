@@ -1,208 +1,17 @@
-import math
-import os
-import uuid
-
-import bmesh
-import bpy
 import mathutils
+import numpy as np
 
-from . import blender_materials
-from . import ldraw_colors
 from . import import_options
 from . import matrices
-from . import special_bricks
-from . import strings
 from .geometry_data import GeometryData
-from . import texmap
-
-part_count = 0
-current_step_group = None
-current_step = 0
-current_frame = 0
-geometry_data_cache = dict()
-top_collection = None
-top_empty = None
-gap_scale_empty = None
-collection_id_map = dict()
-next_collections = []
-next_collection = None
-end_next_collection = False
-key_map = dict()
-
-import_scale_matrix = None
-gap_scale_matrix = None
-
-
-def reset_caches():
-    global part_count
-    global current_step_group
-    global current_step
-    global current_frame
-    global geometry_data_cache
-    global top_collection
-    global top_empty
-    global gap_scale_empty
-    global collection_id_map
-    global next_collections
-    global next_collection
-    global end_next_collection
-    global key_map
-    global import_scale_matrix
-    global gap_scale_matrix
-
-    part_count = 0
-    current_step_group = None
-    current_step = 0
-    current_frame = 0
-    geometry_data_cache = dict()
-    top_collection = None
-    top_empty = None
-    gap_scale_empty = None
-    collection_id_map = dict()
-    next_collections = []
-    next_collection = None
-    end_next_collection = False
-    key_map = dict()
-
-    scale = import_options.import_scale
-    import_scale_matrix = mathutils.Matrix.Scale(scale, 4).freeze()
-    # Matrix(((0.2, 0.0, 0.0, 0.0),
-    #         (0.0, 0.2, 0.0, 0.0),
-    #         (0.0, 0.0, 0.2, 0.0),
-    #         (0.0, 0.0, 0.0, 1.0)))
-
-    scale = import_options.gap_scale
-    gap_scale_matrix = mathutils.Matrix.Scale(scale, 4).freeze()
-    # Matrix(((0.997, 0.0, 0.0, 0.0),
-    #         (0.0, 0.997, 0.0, 0.0),
-    #         (0.0, 0.0, 0.997, 0.0),
-    #         (0.0, 0.0, 0.0, 1.0)))
-
-    set_step()
-
-
-def set_step():
-    if not import_options.meta_step:
-        return
-
-    global current_step_group
-    global current_step
-    global current_frame
-
-    first_frame = (import_options.starting_step_frame + import_options.frames_per_step)
-    current_step_frame = (import_options.frames_per_step * current_step)
-    current_frame = first_frame + current_step_frame
-    current_step += 1
-    if import_options.set_timelime_markers:
-        bpy.context.scene.timeline_markers.new("STEP", frame=current_frame)
-
-    if import_options.meta_step_groups:
-        collection_name = f"Steps"
-        if collection_name not in bpy.data.collections:
-            c = bpy.data.collections.new(collection_name)
-            bpy.context.scene.collection.children.link(c)
-        steps_collection = bpy.data.collections[collection_name]
-
-        collection_name = f"Step {str(current_step)}"
-        if collection_name not in bpy.data.collections:
-            c = bpy.data.collections.new(collection_name)
-            steps_collection.children.link(c)
-        current_step_group = bpy.data.collections[collection_name]
-
-
-# obj.show_name = True
-def do_create_object(mesh):
-    if import_options.instancing:
-        if mesh.name not in bpy.data.objects:
-            bpy.data.objects.new(mesh.name, mesh)
-        instanced_obj = bpy.data.objects[mesh.name]
-
-        collection_name = 'Parts'
-        if collection_name not in bpy.data.collections:
-            parts_collection = bpy.data.collections.new(collection_name)
-            bpy.context.scene.collection.children.link(parts_collection)
-            parts_collection.hide_viewport = True
-            parts_collection.hide_render = True
-        parts_collection = bpy.data.collections[collection_name]
-
-        collection_name = mesh.name
-        if collection_name not in bpy.data.collections:
-            part_collection = bpy.data.collections.new(collection_name)
-            parts_collection.children.link(part_collection)
-        part_collection = bpy.data.collections[collection_name]
-
-        if instanced_obj.name not in part_collection.objects:
-            part_collection.objects.link(instanced_obj)
-
-        obj = bpy.data.objects.new(mesh.name, None)
-        obj.instance_type = 'COLLECTION'
-        obj.instance_collection = part_collection
-    else:
-        obj = bpy.data.objects.new(mesh.name, mesh)
-    return obj
-
-
-# https://docs.blender.org/api/current/bpy.types.bpy_struct.html#bpy.types.bpy_struct.keyframe_insert
-# https://docs.blender.org/api/current/bpy.types.Scene.html?highlight=frame_set#bpy.types.Scene.frame_set
-# https://docs.blender.org/api/current/bpy.types.Object.html?highlight=rotation_quaternion#bpy.types.Object.rotation_quaternion
-def handle_meta_step(obj):
-    bpy.context.scene.frame_set(import_options.starting_step_frame)
-    obj.hide_viewport = True
-    obj.hide_render = True
-    obj.keyframe_insert(data_path="hide_render")
-    obj.keyframe_insert(data_path="hide_viewport")
-    bpy.context.scene.frame_set(current_frame)
-    obj.hide_viewport = False
-    obj.hide_render = False
-    obj.keyframe_insert(data_path="hide_render")
-    obj.keyframe_insert(data_path="hide_viewport")
-
-
-def set_object_matrix(obj, matrix):
-    transform_matrix = matrices.identity @ matrices.rotation @ import_scale_matrix
-
-    if not import_options.parent_to_empty:
-        matrix_world = transform_matrix @ matrix
-
-        if import_options.make_gaps and import_options.gap_target == "object":
-            matrix_world = matrix_world @ gap_scale_matrix
-
-        obj.matrix_world = matrix_world
-        return
-
-    top_empty.matrix_world = transform_matrix
-    obj.matrix_world = matrix
-
-    if import_options.make_gaps and import_options.gap_target == "object":
-        if import_options.gap_scale_strategy == "object":
-            matrix_world = obj.matrix_world @ gap_scale_matrix
-            obj.matrix_world = matrix_world
-        elif import_options.gap_scale_strategy == "constraint":
-            global gap_scale_empty
-            if gap_scale_empty is None:
-                gap_scale_empty = bpy.data.objects.new("gap_scale", None)
-                matrix_world = gap_scale_empty.matrix_world @ gap_scale_matrix
-                gap_scale_empty.matrix_world = matrix_world
-                top_collection.objects.link(gap_scale_empty)
-            copy_scale_constraint = obj.constraints.new("COPY_SCALE")
-            copy_scale_constraint.target = gap_scale_empty
-            copy_scale_constraint.target.parent = top_empty
-
-    obj.parent = top_empty  # must be after matrix_world set or else transform is incorrect
-
-
-def process_face(file, bm, mesh, face, color_code, texmap):
-    face.smooth = import_options.shade_smooth
-    part_slopes = special_bricks.get_part_slopes(file.name)
-
-    material = blender_materials.get_material(color_code, part_slopes=part_slopes, texmap=texmap)
-    # https://blender.stackexchange.com/questions/23905/select-faces-depending-on-material
-    if material.name not in mesh.materials:
-        mesh.materials.append(material)
-    face.material_index = mesh.materials.find(material.name)
-
-    if texmap is not None:
-        texmap.uv_unwrap_face(bm, face)
+
+
+# every submodel is built once for each color it is placed with
+# every part gets its own object when steps are imported, so that each one can be keyframed
+def use_submodel_instancing():
+    if not import_options.instance_submodels:
+        return False
+    return not import_options.meta_step
 
 
 class LDrawNode:
@@ -219,351 +28,422 @@ class LDrawNode:
         self.meta_command = None
         self.meta_args = dict()
 
-    def load(self, parent_matrix=matrices.identity, color_code="16", geometry_data=None, parent_collection=None, is_edge_logo=False):
-        global part_count
-        global top_collection
-        global top_empty
-        global next_collection
-        global end_next_collection
 
+class LDrawInstance:
+    """
+    One placement of a part, or of a submodel if submodel_table is set, resolved into the world.
+
+    models is the chain of model files whose collections it goes in. frame is the frame of the step it is
+    placed in, step_group and group are the names of the step and group collections it goes in.
+    """
+
+    def __init__(self, file, color_code, matrix, is_edge_logo, models, frame=None, step_group=None, group=None, submodel_table=None):
+        self.file = file
+        self.color_code = color_code
+        self.matrix = matrix
+        self.is_edge_logo = is_edge_logo
+        self.models = models
+        self.frame = frame
+        self.step_group = step_group
+        self.group = group
+        self.submodel_table = submodel_table
+
+
+class InstanceTable:
+    """
+    Everything an import places, in the order it is placed, worked out without creating anything in Blender.
+
+    Besides the instances, it keeps the chains of model collections to make, in the order they are first used,
+    the timeline markers, every CLEAR's frame with how many instances came before it,
+    the step collections, and each group collection with the group it is nested in, if any.
+    """
+
+    def __init__(self, import_context):
+        self.import_context = import_context
+        self.instances = []
+        self.model_chains = dict()
+        self.markers = []
+        self.clear_events = []
+        self.step_groups = []
+        self.group_links = []
+
+        self.current_step = 0
+        self.current_frame = 0
+        self.current_step_group = None
+        self.group_names = set()
+        self.collection_id_map = dict()
+        self.next_collections = []
+        self.next_collection = None
+        self.end_next_collection = False
+
+    def set_step(self):
+        if not import_options.meta_step:
+            return
+
+        first_frame = (import_options.starting_step_frame + import_options.frames_per_step)
+        current_step_frame = (import_options.frames_per_step * self.current_step)
+        self.current_frame = first_frame + current_step_frame
+        self.current_step += 1
+        if import_options.set_timelime_markers:
+            self.markers.append(("STEP", self.current_frame))
+
+        if import_options.meta_step_groups:
+            self.current_step_group = f"Step {str(self.current_step)}"
+            self.step_groups.append(self.current_step_group)
+
+    def add_instance(self, file, color_code, matrix, is_edge_logo, models, submodel_table=None):
+        frame = None
+        if import_options.meta_step:
+            frame = self.current_frame
+
+        group = None
         if import_options.meta_group:
-            groups_collection_name = 'Groups'
-            if groups_collection_name not in bpy.data.collections:
-                c = bpy.data.collections.new(groups_collection_name)
-                bpy.context.scene.collection.children.link(c)
-            groups_collection = bpy.data.collections[groups_collection_name]
-
-        if self.file is None:
-            if self.meta_command == "step":
-                set_step()
-            elif self.meta_command == "save":
-                if import_options.meta_save:
-                    if import_options.set_timelime_markers:
-                        bpy.context.scene.timeline_markers.new("SAVE", frame=current_frame)
-            elif self.meta_command == "clear":
-                if import_options.meta_clear:
-                    if import_options.set_timelime_markers:
-                        bpy.context.scene.timeline_markers.new("CLEAR", frame=current_frame)
-                    if top_collection is not None:
-                        for ob in top_collection.all_objects:
-                            bpy.context.scene.frame_set(current_frame)
-                            ob.hide_viewport = True
-                            ob.hide_render = True
-                            ob.keyframe_insert(data_path="hide_render")
-                            ob.keyframe_insert(data_path="hide_viewport")
-            elif self.meta_command == "print":
-                if import_options.meta_print_write:
-                    print(self.meta_args["message"])
-            elif self.meta_command.startswith("group") and import_options.meta_group:
-                if self.meta_command == "group_def":
-                    collection_name = self.meta_args["name"]
-                    collection_id_map[self.meta_args["id"]] = collection_name
-                    if collection_name not in bpy.data.collections:
-                        c = bpy.data.collections.new(collection_name)
-                        groups_collection.children.link(c)
-                elif self.meta_command == "group_nxt":
-                    if self.meta_args["id"] in collection_id_map:
-                        collection_name = collection_id_map[self.meta_args["id"]]
-                        if collection_name in bpy.data.collections:
-                            next_collection = bpy.data.collections[collection_name]
-                    end_next_collection = True
-                elif self.meta_command == "group_begin":
-                    if next_collection is not None:
-                        next_collections.append(next_collection)
-                    collection_name = self.meta_args["name"]
-
-                    if collection_name not in bpy.data.collections:
-                        c = bpy.data.collections.new(collection_name)
-                        groups_collection.children.link(c)
-                    next_collection = bpy.data.collections[collection_name]
-
-                    if len(next_collections) > 0:
-                        next_collections[-1].children.link(next_collection)
-                elif self.meta_command == "group_end":
-                    if len(next_collections) > 0:
-                        next_collection = next_collections.pop()
-                    else:
-                        next_collection = None
+            group = self.next_collection
+
+        self.instances.append(LDrawInstance(
+            file,
+            color_code,
+            matrix,
+            is_edge_logo,
+            models,
+            frame=frame,
+            step_group=self.current_step_group,
+            group=group,
+            submodel_table=submodel_table,
+        ))
+
+    # the nodes under a node are added in the same order as a recursive walk would add them, but each shortcut and
+    # model level is a TraversalFrame on a stack instead of a Python call, so there is no limit to how deep they nest
+    def add_node(self, node, parent_matrix, color_code, models, is_edge_logo, is_root=False):
+        stack = []
+        self.push_node(stack, node, parent_matrix @ node.matrix, color_code, models, is_edge_logo, is_root)
+
+        while len(stack) > 0:
+            frame = stack[-1]
+
+            # every node under the last root child node has been added
+            if frame.ended_node is not None:
+                self.end_root_child(frame.ended_node)
+                frame.ended_node = None
+
+            i = frame.index
+            if i >= len(frame.nodes):
+                stack.pop()
+                continue
+            frame.index = i + 1
+            child_node = frame.nodes[i]
+
+            flattened_model = frame.flattened_model
+            if flattened_model is None:
+                self.push_node(stack, child_node, frame.matrix @ child_node.matrix, frame.color_code, frame.models, frame.is_edge_logo)
+                if frame.is_root:
+                    frame.ended_node = child_node
+                continue
+
+            child_models = frame.models + flattened_model.models[i]
+
+            # the submodels and shortcuts whose nodes follow them are only there so that their collections are made in order
+            if flattened_model.expanded[i]:
+                if child_node.file.is_model():
+                    self.model_chains[child_models] = True
+            elif child_node.file is None:
+                self.add_meta_command(child_node)
+            else:
+                child_color_code = flattened_model.color_codes[i]
+                if child_color_code == "16":
+                    child_color_code = frame.color_code
+
+                self.push_node(
+                    stack,
+                    child_node,
+                    mathutils.Matrix(frame.matrix[i].tolist()),
+                    child_color_code,
+                    child_models,
+                    flattened_model.edge_logos[i],
+                )
+
+            # after the last node that came from each of this file's own child nodes
+            if frame.is_root:
+                child_index = flattened_model.child_indexes[i]
+                if i + 1 == len(frame.nodes) or flattened_model.child_indexes[i + 1] != child_index:
+                    frame.ended_node = frame.file.child_nodes[child_index]
+
+    # adds a node that has nothing under it, otherwise pushes the frame that adds the nodes under it
+    # matrix is where the node itself is placed
+    def push_node(self, stack, node, matrix, color_code, models, is_edge_logo, is_root=False):
+        if node.file is None:
+            self.add_meta_command(node)
             return
 
         # set the working color code to this file's
         # color code if it isn't color code 16
-        if self.color_code != "16":
-            color_code = self.color_code
+        if node.color_code != "16":
+            color_code = node.color_code
 
-        if self.file.is_edge_logo():
+        if node.file.is_edge_logo():
             is_edge_logo = True
 
-        top = False
-        matrix = parent_matrix @ self.matrix
-        collection = parent_collection
-
-        if self.file.is_model():
-            collection_name = os.path.basename(self.file.name[:63])
-            if collection_name not in bpy.data.collections:
-                bpy.data.collections.new(collection_name)
-            collection = bpy.data.collections[collection_name]
-            collection[strings.ldraw_filename_key] = self.file.name
-
-            if top_collection is None:
-                top_collection = collection
-                if top_collection.name not in bpy.context.scene.collection.children:
-                    bpy.context.scene.collection.children.link(top_collection)
-            else:
-                if parent_collection is not None:
-                    if collection.name not in parent_collection.children:
-                        parent_collection.children.link(collection)
-        elif self.file.is_shortcut():
+        if node.file.is_model():
+            if not is_root and use_submodel_instancing():
+                submodel_table = get_submodel_table(self.import_context, node.file, color_code, is_edge_logo)
+                self.add_instance(node.file, color_code, matrix, is_edge_logo, models, submodel_table=submodel_table)
+                return
+
+            models = models + (node.file,)
+            self.model_chains[models] = True
+
+            # the nodes under this model's submodels are gathered once per model file,
+            # and where every one of them is placed is found with one matrix multiply
+            # that is only turned back into a Matrix for the nodes that are added
+            flattened_model = get_flattened_model(self.import_context, node.file)
+            node_matrices = np.array(matrix, dtype=np.float64) @ flattened_model.matrices
+            stack.append(TraversalFrame(
+                flattened_model.nodes,
+                node_matrices,
+                color_code,
+                models,
+                is_edge_logo,
+                is_root,
+                file=node.file,
+                flattened_model=flattened_model,
+            ))
+        elif node.file.is_shortcut():
             # TODO: instead of adding to group, parent to empty
-            pass
-        elif geometry_data is None:  # top-level part
-            geometry_data = GeometryData()
-            matrix = matrices.identity
-            top = True
-            part_count += 1
-
-        # if importing anything but a model, create a group for that part
-        if top_collection is None:
-            collection_name = os.path.basename(self.file.name)
-            collection = bpy.data.collections.new(collection_name)
-            top_collection = collection
-
-        if top_empty is None:
-            top_empty = bpy.data.objects.new(top_collection.name, None)
-            top_collection.objects.link(top_empty)
-
-        _key = []
-        _key.append(self.file.name)
-        _key.append(color_code)
-        _key.append(hash(matrix.freeze()))
-        _key = "_".join([str(k).lower() for k in _key])
-
-        if _key not in key_map:
-            key_map[_key] = str(uuid.uuid4())
-        key = key_map[_key]
-        e_key = f"e_{key}"
-
-        if key in geometry_data_cache:
-            geometry_data = geometry_data_cache[key]
+            stack.append(TraversalFrame(node.file.child_nodes, matrix, color_code, models, is_edge_logo, is_root))
         else:
-            if geometry_data is not None:
-                if (not is_edge_logo) or (is_edge_logo and import_options.display_logo):
-                    geometry_data.add_edge_data(matrix, color_code, self.file.geometry)
-                geometry_data.add_face_data(matrix, color_code, self.file.geometry)
-                geometry_data.add_line_data(matrix, color_code, self.file.geometry)
-
-            for child_node in self.file.child_nodes:
-                child_node.load(
-                    geometry_data=geometry_data,
-                    parent_matrix=matrix,
-                    color_code=color_code,
-                    parent_collection=collection,
-                    is_edge_logo=is_edge_logo,
-                )
+            self.add_instance(node.file, color_code, matrix, is_edge_logo, models)
 
-                if import_options.meta_group:
-                    if self.is_root:
-                        if child_node.meta_command not in ["group_nxt"]:
-                            if end_next_collection:
-                                next_collection = None
-
-            # without "if top:"
-            # 10030-1 - Imperial Star Destroyer - UCS.mpd top back of the bridge - 3794a.dat renders incorrectly
-            if top:
-                geometry_data_cache[key] = geometry_data
-
-        if top:
-            if key not in bpy.data.meshes:
-                bm = bmesh.new()
-
-                mesh = bpy.data.meshes.new(key)
-                mesh.name = key
-                mesh[strings.ldraw_filename_key] = self.file.name
-
-                # https://blender.stackexchange.com/questions/50160/scripting-low-level-join-meshes-elements-hopefully-with-bmesh
-                # https://blender.stackexchange.com/questions/188039/how-to-join-only-two-objects-to-create-a-new-object-using-python
-                # FIXME: 31313 - Mindstorms EV3 - Spike3r.mpd - "31313 - 13710ac01.dat"
-                # FIXME: if not treat_shortcut_as_model, texmap uvs may be incorrect, caused by unexpected part transform?
-                # FIXME: move uv unwrap to after obj[strings.ldraw_filename_key] = self.file.name
-                for fd in geometry_data.face_data:
-                    for fi in fd.face_infos:
-                        verts = []
-                        for vertex in fi.vertices:
-                            vert = fd.matrix @ vertex
-                            bm_vert = bm.verts.new(vert)
-                            verts.append(bm_vert)
-                        face = bm.faces.new(verts)
-
-                        color_code = fd.color_code
-                        if fi.color_code != "16":
-                            color_code = fi.color_code
-
-                        process_face(self.file, bm, mesh, face, color_code, fi.texmap)
-
-                bm.faces.ensure_lookup_table()
-                bm.verts.ensure_lookup_table()
-                bm.edges.ensure_lookup_table()
-
-                if import_options.remove_doubles:
-                    # TODO: if vertices in sharp edge collection, do not add to merge collection
-                    bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=import_options.merge_distance)
-
-                if import_options.recalculate_normals:
-                    bmesh.ops.recalc_face_normals(bm, faces=bm.faces[:])
-
-                # bpy.context.object.data.edges[6].use_edge_sharp = True
-                # Create kd tree for fast "find nearest points" calculation
-                # https://docs.blender.org/api/blender_python_api_current/mathutils.kdtree.html
-                vertices = bm.verts
-                kd = mathutils.kdtree.KDTree(len(vertices))
-                for i, v in enumerate(vertices):
-                    kd.insert(v.co, i)
-                kd.balance()
-
-                # increase the distance to look for edges to merge
-                # merge line type 2 edges at a greater distance than mesh edges
-                distance = import_options.merge_distance
-                distance = import_options.merge_distance * 2
-
-                edge_mesh = bpy.data.meshes.new(e_key)
-                edge_mesh.name = e_key
-                edge_mesh[strings.ldraw_filename_key] = self.file.name
-
-                e_verts = []
-                e_edges = []
-                e_faces = []
-                i = 0
-                # Create edge_indices dictionary, which is the list of edges as pairs of indices into our verts array
-                edge_indices = set()
-                for ed in geometry_data.edge_data:
-                    for fi in ed.face_infos:
-                        edge_verts = []
-                        face_indices = []
-                        for vertex in fi.vertices:
-                            vert = ed.matrix @ vertex
-                            e_verts.append(vert)
-                            edge_verts.append(vert)
-                            face_indices.append(i)
-                            i += 1
-                        e_faces.append(face_indices)
-
-                        edges0 = [index for (co, index, dist) in kd.find_range(edge_verts[0], distance)]
-                        edges1 = [index for (co, index, dist) in kd.find_range(edge_verts[1], distance)]
-                        for e0 in edges0:
-                            for e1 in edges1:
-                                edge_indices.add((e0, e1))
-                                edge_indices.add((e1, e0))
-
-                edge_mesh.from_pydata(e_verts, e_edges, e_faces)
-                edge_mesh.update()
-                edge_mesh.validate()
-
-                # Find the appropriate mesh edges and make them sharp (i.e. not smooth)
-                merge = set()
-                for edge in bm.edges:
-                    v0 = edge.verts[0].index
-                    v1 = edge.verts[1].index
-                    if (v0, v1) in edge_indices:
-                        merge.add(edge.verts[0])
-                        merge.add(edge.verts[1])
-
-                        # Make edge sharp
-                        edge.smooth = False
-
-                if import_options.remove_doubles:
-                    # if it was detected as a edge, then merge those vertices
-                    bmesh.ops.remove_doubles(bm, verts=list(merge), dist=distance)
-
-                bm.to_mesh(mesh)
-                bm.clear()
-                bm.free()
-
-                mesh.update()
-                mesh.validate()
-
-                for edge in mesh.edges:
-                    v0 = edge.vertices[0]
-                    v1 = edge.vertices[1]
-                    if (v0, v1) in edge_indices:
-                        edge.use_edge_sharp = True
-                        edge.use_freestyle_mark = True
-
-                if import_options.smooth_type == "auto_smooth":
-                    mesh.use_auto_smooth = import_options.shade_smooth
-                    auto_smooth_angle = 31
-                    auto_smooth_angle = 44.97
-                    auto_smooth_angle = 51.1
-                    auto_smooth_angle = 89.9  # 1.56905 - 89.9 so 90 degrees and up are affected
-                    mesh.auto_smooth_angle = math.radians(auto_smooth_angle)
-
-                if import_options.make_gaps and import_options.gap_target == "mesh":
-                    mesh.transform(gap_scale_matrix)
-                    edge_mesh.transform(gap_scale_matrix)
-            mesh = bpy.data.meshes[key]
-            obj = do_create_object(mesh)
-            obj[strings.ldraw_filename_key] = self.file.name
-
-            # bpy.context.space_data.shading.color_type = 'MATERIAL'
-            # bpy.context.space_data.shading.color_type = 'OBJECT'
-            # Shading > Color > Object to see object colors
-            color = ldraw_colors.get_color(color_code)
-            obj.color = color.color + (color.alpha,)
-
-            matrix = parent_matrix @ self.matrix
-            set_object_matrix(obj, matrix)
-
-            if import_options.meta_step:
-                handle_meta_step(obj)
-
-            if import_options.smooth_type == "edge_split":
-                edge_modifier = obj.modifiers.new("Edge Split", type='EDGE_SPLIT')
-                edge_modifier.use_edge_angle = True
-                edge_modifier.split_angle = math.radians(89.9)
-                edge_modifier.use_edge_sharp = True
-
-            # https://b3d.interplanety.org/en/how-to-get-global-vertex-coordinates/
-            collection.objects.link(obj)
-
-            if current_step_group is not None:
-                current_step_group.objects.link(obj)
-
-            if import_options.meta_group:
-                if next_collection is not None:
-                    next_collection.objects.link(obj)
+    def end_root_child(self, child_node):
+        if import_options.meta_group:
+            if child_node.meta_command not in ["group_nxt"]:
+                if self.end_next_collection:
+                    self.next_collection = None
+
+    def add_meta_command(self, node):
+        if node.meta_command == "step":
+            self.set_step()
+        elif node.meta_command == "save":
+            if import_options.meta_save:
+                if import_options.set_timelime_markers:
+                    self.markers.append(("SAVE", self.current_frame))
+        elif node.meta_command == "clear":
+            if import_options.meta_clear:
+                if import_options.set_timelime_markers:
+                    self.markers.append(("CLEAR", self.current_frame))
+                self.clear_events.append((self.current_frame, len(self.instances)))
+        elif node.meta_command == "print":
+            if import_options.meta_print_write:
+                print(node.meta_args["message"])
+        elif node.meta_command.startswith("group") and import_options.meta_group:
+            if node.meta_command == "group_def":
+                collection_name = node.meta_args["name"]
+                self.collection_id_map[node.meta_args["id"]] = collection_name
+                self.add_group(collection_name)
+            elif node.meta_command == "group_nxt":
+                if node.meta_args["id"] in self.collection_id_map:
+                    collection_name = self.collection_id_map[node.meta_args["id"]]
+                    if collection_name in self.group_names:
+                        self.next_collection = collection_name
+                self.end_next_collection = True
+            elif node.meta_command == "group_begin":
+                if self.next_collection is not None:
+                    self.next_collections.append(self.next_collection)
+                collection_name = node.meta_args["name"]
+                self.add_group(collection_name)
+                self.next_collection = collection_name
+
+                if len(self.next_collections) > 0:
+                    self.group_links.append((collection_name, self.next_collections[-1]))
+            elif node.meta_command == "group_end":
+                if len(self.next_collections) > 0:
+                    self.next_collection = self.next_collections.pop()
                 else:
-                    collection_name = 'Ungrouped'
-                    if collection_name not in bpy.data.collections:
-                        c = bpy.data.collections.new(collection_name)
-                        groups_collection.children.link(c)
-                    ungrouped_collection = bpy.data.collections[collection_name]
-                    ungrouped_collection.objects.link(obj)
-
-            if import_options.import_edges:
-                edge_mesh = bpy.data.meshes[e_key]
-                edge_obj = do_create_object(edge_mesh)
-                edge_obj[strings.ldraw_filename_key] = f"{self.file.name}_edges"
-
-                edge_obj.parent = obj
-                edge_obj.matrix_world = obj.matrix_world
-
-                if import_options.meta_step:
-                    handle_meta_step(obj)
-
-                collection.objects.link(edge_obj)
-
-                if current_step_group is not None:
-                    current_step_group.objects.link(obj)
-
-                if import_options.meta_group:
-                    if next_collection is not None:
-                        next_collection.objects.link(edge_obj)
-                    else:
-                        collection_name = 'Ungrouped'
-                        if collection_name not in bpy.data.collections:
-                            c = bpy.data.collections.new(collection_name)
-                            groups_collection.children.link(c)
-                        ungrouped_collection = bpy.data.collections[collection_name]
-                        ungrouped_collection.objects.link(edge_obj)
-
-        texmap.reset_caches()  # or else the previous part's texmap is applied to this part
-        return self
+                    self.next_collection = None
+
+    def add_group(self, collection_name):
+        if collection_name not in self.group_names:
+            self.group_names.add(collection_name)
+            self.group_links.append((collection_name, None))
+
+
+class TraversalFrame:
+    """
+    One shortcut or model level of InstanceTable.add_node, what is inherited by the nodes under it
+    and how far through them it is.
+
+    For a model, nodes are its flattened nodes and matrix is where every one of them is placed.
+    For a shortcut, matrix is where the shortcut is placed.
+    ended_node is the root child node whose nodes have all been added, once the stack is back down to this frame.
+    """
+
+    __slots__ = ("nodes", "index", "matrix", "color_code", "models", "is_edge_logo", "is_root", "file", "flattened_model", "ended_node")
+
+    def __init__(self, nodes, matrix, color_code, models, is_edge_logo, is_root, file=None, flattened_model=None):
+        self.nodes = nodes
+        self.index = 0
+        self.matrix = matrix
+        self.color_code = color_code
+        self.models = models
+        self.is_edge_logo = is_edge_logo
+        self.is_root = is_root
+        self.file = file
+        self.flattened_model = flattened_model
+        self.ended_node = None
+
+
+# the first phase of an import, everything file places without anything being created in Blender
+def resolve(import_context, file):
+    instance_table = InstanceTable(import_context)
+    instance_table.set_step()
+
+    root_node = LDrawNode()
+    root_node.is_root = True
+    root_node.file = file
+    instance_table.add_node(root_node, matrices.identity, "16", (), False, is_root=True)
+    fill_submodel_tables(import_context)
+    return instance_table
+
+
+# what a submodel places in its own space, when it is placed with color_code
+# its meta commands only apply to itself
+# it is filled by fill_submodel_tables, so submodels nested in submodels don't fill each other's tables recursively
+def get_submodel_table(import_context, file, color_code, is_edge_logo):
+    _key = (file.name, color_code)
+    submodel_table = import_context.submodel_tables.get(_key)
+    if submodel_table is None:
+        submodel_table = InstanceTable(import_context)
+        import_context.submodel_tables[_key] = submodel_table
+        import_context.unfilled_submodel_tables.append((submodel_table, file, color_code, is_edge_logo))
+    return submodel_table
+
+
+def fill_submodel_tables(import_context):
+    while len(import_context.unfilled_submodel_tables) > 0:
+        submodel_table, file, color_code, is_edge_logo = import_context.unfilled_submodel_tables.pop()
+        for child_node in file.child_nodes:
+            submodel_table.add_node(child_node, matrices.identity, color_code, (), is_edge_logo)
+
+
+# the faces of a part and everything it references, in the part's space
+def get_geometry_data(import_context, file, color_code, is_edge_logo=False):
+    _key = (file.name, color_code)
+    geometry_data = import_context.geometry_data_cache.get(_key)
+    if geometry_data is None:
+        geometry_data = GeometryData()
+        add_geometry_data(geometry_data, file, matrices.identity, color_code, is_edge_logo or file.is_edge_logo())
+        import_context.geometry_data_cache[_key] = geometry_data
+    return geometry_data
+
+
+# files are taken off of the stack in the order a recursive walk would reach them
+def add_geometry_data(geometry_data, file, matrix, color_code, is_edge_logo):
+    stack = [(file, matrix, color_code, is_edge_logo)]
+    while len(stack) > 0:
+        file, matrix, color_code, is_edge_logo = stack.pop()
+
+        if (not is_edge_logo) or (is_edge_logo and import_options.display_logo):
+            geometry_data.add_edge_data(matrix, color_code, file.geometry)
+        geometry_data.add_face_data(matrix, color_code, file.geometry)
+        geometry_data.add_line_data(matrix, color_code, file.geometry)
+
+        for child_node in reversed(file.child_nodes):
+            if child_node.file is None:
+                continue
+
+            child_color_code = color_code
+            if child_node.color_code != "16":
+                child_color_code = child_node.color_code
+
+            stack.append((
+                child_node.file,
+                matrix @ child_node.matrix,
+                child_color_code,
+                is_edge_logo or child_node.file.is_edge_logo(),
+            ))
+
+
+class FlattenedModel:
+    """
+    Every node placed by a model, directly or through its submodels and shortcuts, in the order they are loaded.
+
+    Node i is placed at matrices[i], in the model's space, with color_codes[i], which is 16 if it
+    inherits the model's color. models[i] is the chain of submodels between the model and the node,
+    child_indexes[i] is the index of the model's own child node it came from, and expanded[i] is True if
+    the node is a submodel or shortcut whose own nodes follow it.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.matrices = []
+        self.parent_matrices = []
+        self.color_codes = []
+        self.models = []
+        self.edge_logos = []
+        self.child_indexes = []
+        self.expanded = []
+
+    # each frame of the stack is [child nodes, index of the next one, matrix, color code, models, is_edge_logo, child index]
+    def add_nodes(self, file, matrix, color_code, models, is_edge_logo):
+        stack = [[file.child_nodes, 0, matrix, color_code, models, is_edge_logo, None]]
+        while len(stack) > 0:
+            frame = stack[-1]
+            child_nodes, i, matrix, color_code, models, is_edge_logo, child_index = frame
+            if i >= len(child_nodes):
+                stack.pop()
+                continue
+            frame[1] = i + 1
+            child_node = child_nodes[i]
+
+            if child_index is None:
+                node_child_index = i
+            else:
+                node_child_index = child_index
+
+            is_expanded = False
+            if child_node.file is not None:
+                if child_node.file.is_model():
+                    is_expanded = not use_submodel_instancing()
+                elif child_node.file.is_shortcut():
+                    is_expanded = True
+
+            node_models = models
+            if is_expanded and child_node.file.is_model():
+                node_models = models + (child_node.file,)
+
+            self.nodes.append(child_node)
+            self.parent_matrices.append(matrix)
+            self.matrices.append(child_node.matrix)
+            self.color_codes.append(color_code)
+            self.models.append(node_models)
+            self.edge_logos.append(is_edge_logo)
+            self.child_indexes.append(node_child_index)
+            self.expanded.append(is_expanded)
+
+            if is_expanded:
+                child_color_code = color_code
+                if child_node.color_code != "16":
+                    child_color_code = child_node.color_code
+
+                stack.append([
+                    child_node.file.child_nodes,
+                    0,
+                    matrix @ child_node.matrix,
+                    child_color_code,
+                    node_models,
+                    is_edge_logo or child_node.file.is_edge_logo(),
+                    node_child_index,
+                ])
+
+
+def get_flattened_model(import_context, file):
+    flattened_model = import_context.flattened_models.get(file.name)
+    if flattened_model is None:
+        flattened_model = FlattenedModel()
+        flattened_model.add_nodes(file, matrices.identity, "16", (), False)
+        # every node's own matrix is put in the model's space with one multiply
+        parent_matrices = np.array(flattened_model.parent_matrices, dtype=np.float64).reshape(-1, 4, 4)
+        node_matrices = np.array(flattened_model.matrices, dtype=np.float64).reshape(-1, 4, 4)
+        flattened_model.matrices = parent_matrices @ node_matrices
+        flattened_model.parent_matrices = None
+        import_context.flattened_models[file.name] = flattened_model
+    return flattened_model
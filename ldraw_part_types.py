@@ -1,3 +1,5 @@
+# this module doesn't import the rest of the addon, so that parse_pool's worker processes can run it on its own
+
 configuration_types = ["configuration"]
 model_types = ["model", "unofficial_model", "un-official model", "submodel", None]
 part_types = ["part", "unofficial_part", "un-official part"]
@@ -12,3 +14,42 @@ stud_names = [
 edge_logo_names = ["logo.dat", "logo2.dat"]
 logo_names = ["logo3.dat", "logo4.dat", "logo5.dat"]
 logos = ["logo", "logo2", "logo3", "logo4", "logo5", "high-contrast"]
+
+# the second token of the 0 lines that give a file's part type
+part_type_commands = {"!LDRAW_ORG", "LDRAW_ORG", "Official", "Unofficial", "Un-official"}
+
+
+# 0 !LDRAW_ORG, 0 LDRAW_ORG, 0 Unofficial, 0 Un-official, 0 Official LCAD
+# returns the lowercase part type the line gives, or None if it doesn't give one
+def get_actual_part_type(line):
+    _params = line.strip().split(maxsplit=3)
+    if len(_params) < 3 or _params[0] != "0":
+        return None
+    if _params[1] == "Official":
+        if _params[2] != "LCAD" or len(_params) < 4:
+            return None
+        return _params[3].lower()
+    if _params[1] in part_type_commands:
+        return line.strip().split(maxsplit=2)[2].lower()
+    return None
+
+
+def determine_part_type(actual_part_type):
+    if "primitive" in actual_part_type:
+        return "primitive"
+    elif "subpart" in actual_part_type:
+        return "subpart"
+    elif "part" in actual_part_type:
+        return "part"
+    elif "shortcut" in actual_part_type:
+        return "shortcut"
+    elif "model" in actual_part_type:
+        return "model"
+    elif "configuration" in actual_part_type:
+        return "configuration"
+    return "part"
+
+
+# this allows shortcuts to be split into their individual parts if desired
+def is_like_model(part_type, treat_shortcut_as_model):
+    return part_type in model_types or (treat_shortcut_as_model and part_type in shortcut_types)
@@ -0,0 +1,138 @@
+"""Compiles an LDraw library folder into a single pack file that is read through a memory map.
+
+Layout:
+header - magic, version, entry count, slot count
+table  - slot count slots, each holding the hash, length and offset of a name and the offset and length of its body
+names  - the relative names of every file in the library, utf-8, / separated
+bodies - the contents of every file in the library
+
+Names are found by hashing the lowercase name into the table and probing forward until the name or an empty slot is
+found. A pack is built by running this file directly:
+
+python library_pack.py <ldraw folder> <pack file>
+"""
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+MAGIC = b'LDPK'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+SLOT = struct.Struct('<IIQQQ')
+
+
+def hash_name(name):
+    return zlib.crc32(name.lower().encode())
+
+
+def build_pack(library_path, pack_path):
+    names = []
+    for folder, dirs, files in os.walk(library_path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.startswith('.'):
+                continue
+            names.append(os.path.relpath(os.path.join(folder, file), library_path).replace(os.path.sep, '/'))
+
+    slot_count = 1
+    while slot_count < len(names) * 2:
+        slot_count *= 2
+
+    encoded_names = [name.encode() for name in names]
+    names_offset = HEADER.size + SLOT.size * slot_count
+    bodies_offset = names_offset + sum(len(n) for n in encoded_names)
+
+    slots = [None] * slot_count
+    temp_path = f"{pack_path}.tmp"
+    with open(temp_path, 'wb') as pack:
+        pack.write(HEADER.pack(MAGIC, VERSION, len(names), slot_count))
+        pack.seek(names_offset)
+        for encoded_name in encoded_names:
+            pack.write(encoded_name)
+
+        name_offset = names_offset
+        body_offset = bodies_offset
+        for name, encoded_name in zip(names, encoded_names):
+            with open(os.path.join(library_path, name), 'rb') as file:
+                body = file.read()
+            pack.write(body)
+
+            name_hash = hash_name(name)
+            slot = name_hash & (slot_count - 1)
+            while slots[slot] is not None:
+                slot = (slot + 1) & (slot_count - 1)
+            slots[slot] = (name_hash, len(encoded_name), name_offset, body_offset, len(body))
+
+            name_offset += len(encoded_name)
+            body_offset += len(body)
+
+        pack.seek(HEADER.size)
+        for slot in slots:
+            if slot is None:
+                pack.write(SLOT.pack(0, 0, 0, 0, 0))
+            else:
+                pack.write(SLOT.pack(*slot))
+    os.replace(temp_path, pack_path)
+    return len(names)
+
+
+class PackFile:
+    """
+    An open pack file. Bodies are sliced out of the memory map without copying the pack.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.file = open(filepath, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+
+        magic, version, self.entry_count, self.slot_count = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{filepath} is not a version {VERSION} LDraw pack")
+
+    # every body read from the pack has to have been released first, or closing the memory map raises BufferError
+    def close(self):
+        try:
+            self.view.release()
+            self.mmap.close()
+        finally:
+            self.file.close()
+
+    def names(self):
+        with self.view[HEADER.size:HEADER.size + SLOT.size * self.slot_count] as table:
+            for name_hash, name_length, name_offset, body_offset, body_length in SLOT.iter_unpack(table):
+                if name_length > 0:
+                    yield self.read_name(name_offset, name_length)
+
+    def read_name(self, name_offset, name_length):
+        with self.view[name_offset:name_offset + name_length] as name:
+            return str(name, 'utf-8')
+
+    # returns a memoryview of name's body or None
+    # it has to be released before the pack is closed, which using it in a with statement does
+    def read(self, name):
+        name_hash = hash_name(name)
+        lower_name = name.lower()
+        slot = name_hash & (self.slot_count - 1)
+        while True:
+            slot_offset = HEADER.size + SLOT.size * slot
+            slot_hash, name_length, name_offset, body_offset, body_length = SLOT.unpack_from(self.view, slot_offset)
+            if name_length == 0:
+                return None
+            if slot_hash == name_hash:
+                slot_name = self.read_name(name_offset, name_length)
+                if slot_name.lower() == lower_name:
+                    return self.view[body_offset:body_offset + body_length]
+            slot = (slot + 1) & (self.slot_count - 1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        exit("usage: python library_pack.py <ldraw folder> <pack file>")
+    count = build_pack(sys.argv[1], sys.argv[2])
+    print(f"packed {count} files into {sys.argv[2]}")
@@ -7,7 +7,7 @@ from . import helpers
 from . import import_options
 from . import filesystem
 from . import ldraw_colors
-from . import ldraw_node
+from . import blender_scene
 from . import blender_import
 from . import ldraw_part_types
 
@@ -55,6 +55,11 @@ default_settings = {
     'triangulate': import_options.defaults['triangulate'],
     'sharpen_edges': import_options.defaults['sharpen_edges'],
     'instancing': import_options.defaults['instancing'],
+    'shared_meshes': import_options.defaults['shared_meshes'],
+    'point_instancing': import_options.defaults['point_instancing'],
+    'instance_submodels': import_options.defaults['instance_submodels'],
+    'parallel_parse': import_options.defaults['parallel_parse'],
+    'prefetch_files': import_options.defaults['prefetch_files'],
 }
 
 
@@ -106,7 +111,7 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator, ImportHelper):
 
     ldraw_path: bpy.props.StringProperty(
         name="LDraw path",
-        description="Full filepath to the LDraw Parts Library (download from http://www.ldraw.org)",
+        description="Full filepath to the LDraw Parts Library, its complete.zip or an .ldpack (download from http://www.ldraw.org)",
         default=get_setting('ldraw_path'),
     )
 
@@ -348,6 +353,36 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator, ImportHelper):
         default=get_setting('instancing'),
     )
 
+    shared_meshes: bpy.props.BoolProperty(
+        name="Share meshes between colors",
+        description="Build one mesh per part for all plain colors. Faces that take the part's color use the object's color. Not used with instancing",
+        default=get_setting('shared_meshes'),
+    )
+
+    point_instancing: bpy.props.BoolProperty(
+        name="Point instancing",
+        description="Place all copies of a part in one color as points of a single object instanced with geometry nodes. Needs Blender 3.2. Not used with STEP",
+        default=get_setting('point_instancing'),
+    )
+
+    instance_submodels: bpy.props.BoolProperty(
+        name="Instance submodels",
+        description="Build each submodel once and place every use of it as a collection instance. Not used with STEP",
+        default=get_setting('instance_submodels'),
+    )
+
+    parallel_parse: bpy.props.BoolProperty(
+        name="Parallel parse",
+        description="Parse the parts of the model in several processes. Faster for large models whose parts haven't been parsed yet",
+        default=get_setting('parallel_parse'),
+    )
+
+    prefetch_files: bpy.props.BoolProperty(
+        name="Prefetch files",
+        description="Read the files the model uses in background threads while it is parsed. Faster when the library is on a network drive",
+        default=get_setting('prefetch_files'),
+    )
+
     profile: bpy.props.BoolProperty(
         name="Profile",
         description="Profile import performance",
@@ -395,6 +430,11 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator, ImportHelper):
             'triangulate': self.triangulate,
             'sharpen_edges': self.sharpen_edges,
             'instancing': self.instancing,
+            'shared_meshes': self.shared_meshes,
+            'point_instancing': self.point_instancing,
+            'instance_submodels': self.instance_submodels,
+            'parallel_parse': self.parallel_parse,
+            'prefetch_files': self.prefetch_files,
         }
         save_settings()
 
@@ -433,11 +473,16 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator, ImportHelper):
         import_options.triangulate = self.triangulate
         import_options.sharpen_edges = self.sharpen_edges
         import_options.instancing = self.instancing
+        import_options.shared_meshes = self.shared_meshes
+        import_options.point_instancing = self.point_instancing
+        import_options.instance_submodels = self.instance_submodels
+        import_options.parallel_parse = self.parallel_parse
+        import_options.prefetch_files = self.prefetch_files
 
         # https://docs.python.org/3/library/profile.html
         if self.profile:
             profiler.enable()
-        blender_import.do_import(bpy.path.abspath(self.filepath))
+        import_context = blender_import.do_import(bpy.path.abspath(self.filepath))
         if self.profile:
             profiler.disable()
             # pstats.Stats(profiler).sort_stats('tottime').print_stats()
@@ -446,7 +491,9 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator, ImportHelper):
         print("")
         print("======Import Complete======")
         print(self.filepath)
-        print(f"Part count: {ldraw_node.part_count}")
+        print(f"Part count: {blender_scene.part_count}")
+        if import_context.prefetcher is not None:
+            print(import_context.prefetcher.get_summary())
         end = time.monotonic()
         elapsed = (end - start)
         print(f"elapsed: {elapsed}")
@@ -513,6 +560,11 @@ class IMPORT_OT_do_ldraw_import(bpy.types.Operator, ImportHelper):
         col.prop(self, "sharpen_edges")
         col.prop(self, "use_freestyle_edges")
         col.prop(self, "import_edges")
+        col.prop(self, "shared_meshes")
+        col.prop(self, "point_instancing")
+        col.prop(self, "instance_submodels")
+        col.prop(self, "parallel_parse")
+        col.prop(self, "prefetch_files")
         # col.prop(self, "treat_shortcut_as_model")
         col.prop(self, "prefer_unofficial")
         col.prop(self, "no_studs")
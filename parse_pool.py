@@ -0,0 +1,216 @@
+import concurrent.futures
+import importlib.util
+import multiprocessing
+import os
+import queue
+import site
+import sys
+
+from . import filesystem
+from . import helpers
+from . import import_options
+from . import ldraw_file
+from .ldraw_geometry import LDrawGeometry
+
+# starting the workers costs about half a second, spawning them and importing numpy in each one,
+# and a part takes about 3ms to parse, so fewer files than this are parsed faster without them
+min_pool_files = 200
+# files are sent to the workers in batches of up to this many, so that sending a task and its result back
+# costs less than parsing it, and in smaller batches while there are few of them so that every worker gets some
+max_batch_size = 32
+
+this_script_dir = os.path.dirname(os.path.realpath(__file__))
+# parse_worker imports the modules before it by name, so they are loaded first
+worker_module_names = ['ldraw_part_types', 'ldraw_geometry', 'parse_worker']
+
+
+# every file that importing filename will parse is read and parsed by parse_worker in worker processes,
+# which follow the files each one references as they are parsed, so the main process only locates them
+# if a file's type 2 to 5 lines could be parsed on their own, its other lines are put in
+# import_context.read_ahead_lines and its geometry in import_context.parsed_geometry,
+# otherwise its bytes are put in import_context.read_ahead_data
+# anything that isn't parsed here, for whatever reason, is read and parsed the usual way by LDrawFile.get_file
+# python_executable is what the workers are run with, which has to be a python and not Blender
+def parse_dependencies(import_context, filename, python_executable=sys.executable):
+    mpd_files = {}
+    queued = set()
+    filepaths = locate_subfiles(import_context, read_model(import_context, filename, mpd_files), mpd_files, queued)
+    filepaths = find_dependencies(import_context, filepaths, mpd_files, queued)
+    if len(filepaths) < min_pool_files:
+        return
+
+    try:
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(python_executable)
+        worker = get_worker_module()
+        with concurrent.futures.ProcessPoolExecutor(
+                mp_context=context,
+                initializer=site.addsitedir,
+                initargs=(this_script_dir,),
+        ) as executor:
+            parsed_count = parse_files(import_context, executor, worker, filepaths, mpd_files, queued)
+    except Exception as e:
+        # whatever wasn't parsed is parsed the usual way
+        print(f"parallel parse stopped, parsing the rest in this process: {e}")
+        return
+
+    print(f"parsed {parsed_count} files in {os.cpu_count()} processes")
+
+
+# returns the paths of the files found by following the references of filepaths breadth first,
+# which are read here until min_pool_files have been found or there are none left,
+# since the pool is only worth starting for that many
+# the files read are put in import_context.read_ahead_data, so get_file doesn't read them again either way
+def find_dependencies(import_context, filepaths, mpd_files, queued):
+    found_filepaths = list(filepaths)
+    read_count = 0
+    while read_count < len(found_filepaths) and len(found_filepaths) < min_pool_files:
+        filepath = found_filepaths[read_count]
+        read_count += 1
+
+        data = ldraw_file.read_data(filepath)
+        import_context.read_ahead_data[filepath] = data
+        files, first_mpd_filename = ldraw_file.index_data(os.path.basename(filepath), data)
+        if first_mpd_filename is not None:
+            mpd_files.update(files)
+
+        # get_file reports it if it can't be decoded
+        lines = data.decode('utf-8', errors='replace').splitlines()
+        found_filepaths.extend(locate_subfiles(import_context, get_subfile_names(lines), mpd_files, queued))
+    return found_filepaths
+
+
+# returns how many files were parsed
+# the results are taken as they come in, so that the files they reference are sent to the workers straight away
+# the first batch that fails stops the pool, and the batches that haven't started are cancelled
+def parse_files(import_context, executor, worker, filepaths, mpd_files, queued):
+    parsed_count = 0
+    futures = {}
+    done_futures = queue.SimpleQueue()
+    while len(filepaths) > 0 or len(futures) > 0:
+        batch_size = min(max_batch_size, max(1, len(filepaths) // os.cpu_count()))
+        for i in range(0, len(filepaths), batch_size):
+            batch = filepaths[i:i + batch_size]
+            future = executor.submit(
+                worker.parse_files,
+                [(filepath, get_worker_data(import_context, filepath)) for filepath in batch],
+                import_options.triangulate,
+                import_options.treat_shortcut_as_model,
+            )
+            futures[future] = batch
+            future.add_done_callback(done_futures.put)
+        filepaths = []
+
+        future = done_futures.get()
+        batch = futures.pop(future)
+        try:
+            results = future.result()
+        except Exception:
+            for pending_future in futures:
+                pending_future.cancel()
+            raise
+
+        for filepath, (contents, subfile_names, arrays) in zip(batch, results):
+            parsed_count += 1
+            if arrays is None:
+                import_context.read_ahead_data[filepath] = contents
+                files, first_mpd_filename = ldraw_file.index_data(os.path.basename(filepath), contents)
+                if first_mpd_filename is not None:
+                    mpd_files.update(files)
+            else:
+                import_context.read_ahead_data.pop(filepath, None)
+                import_context.read_ahead_lines[filepath] = contents
+                import_context.parsed_geometry[filepath] = LDrawGeometry.from_arrays(*arrays)
+
+            filepaths.extend(locate_subfiles(import_context, subfile_names, mpd_files, queued))
+    return parsed_count
+
+
+# the bytes the worker parses filepath from, if they have been read already or it is in an archive,
+# otherwise None, and the worker reads it itself
+def get_worker_data(import_context, filepath):
+    data = import_context.read_ahead_data.get(filepath)
+    if data is None and filesystem.get_archive(filepath) is not None:
+        data = filesystem.read_bytes(filepath)
+    return data
+
+
+# the workers can't import this addon, because its __init__ imports bpy
+# so they import parse_worker and the modules it uses on their own, from the folder the initializer adds to their
+# sys.path, and they are loaded the same way here so that the function given to them is pickled by that name
+def get_worker_module():
+    for worker_module_name in worker_module_names:
+        if worker_module_name not in sys.modules:
+            spec = importlib.util.spec_from_file_location(worker_module_name, os.path.join(this_script_dir, f"{worker_module_name}.py"))
+            worker = importlib.util.module_from_spec(spec)
+            sys.modules[worker_module_name] = worker
+            spec.loader.exec_module(worker)
+    return sys.modules[worker_module_names[-1]]
+
+
+# the model is parsed in the main process anyway, so it is read here and only its type 1 lines are looked at
+# the FILEs of an MPD are found by name before the library is searched, like in file_lines_cache,
+# and only the ones that are referenced are looked at
+# returns the names of the files it references that aren't FILEs of it
+def read_model(import_context, filename, mpd_files):
+    filepath = filesystem.locate(filename, count_missing=False)
+    if filepath is None:
+        return []
+
+    data = ldraw_file.read_data(filepath)
+    import_context.read_ahead_data[filepath] = data
+    files, first_mpd_filename = ldraw_file.index_data(filename, data)
+    if first_mpd_filename is not None:
+        mpd_files.update(files)
+        filename = first_mpd_filename
+
+    subfile_names = []
+    stack = [filename]
+    model_names = {filename}
+    while len(stack) > 0:
+        lines_file = files.get(stack.pop())
+        if lines_file is None:
+            continue
+
+        for subfile_name in get_subfile_names(lines_file.lines):
+            if subfile_name not in files:
+                subfile_names.append(subfile_name)
+            elif subfile_name not in model_names:
+                model_names.add(subfile_name)
+                stack.append(subfile_name)
+    return subfile_names
+
+
+# the names the type 1 lines of lines reference
+def get_subfile_names(lines):
+    subfile_names = []
+    for line in lines:
+        if not line.lstrip().startswith("1"):
+            continue
+        _params = helpers.clean_line(line).split(maxsplit=14)
+        if len(_params) < 15 or _params[0] != "1":
+            continue
+        subfile_names.append(ldraw_file.get_subfile_name(_params[14].lower()))
+    return subfile_names
+
+
+# returns the paths of the files subfile_names reference that haven't been queued, read or parsed yet
+# queued holds both the names and the paths that have been looked at, since two names can be the same file
+def locate_subfiles(import_context, subfile_names, mpd_files, queued):
+    filepaths = []
+    for subfile_name in subfile_names:
+        subfile_name = ldraw_file.get_subfile_name(subfile_name)
+        if subfile_name in queued:
+            continue
+        queued.add(subfile_name)
+
+        if subfile_name in mpd_files or subfile_name in import_context.file_lines_cache:
+            continue
+        filepath = filesystem.locate(subfile_name, count_missing=False)
+        if filepath is None or filepath in queued or filepath in import_context.read_ahead_data:
+            continue
+        queued.add(filepath)
+        if ldraw_file.get_parsed_file(ldraw_file.get_parsed_file_key(filepath)) is not None:
+            continue
+        filepaths.append(filepath)
+    return filepaths
@@ -0,0 +1,73 @@
+import io
+
+import ldraw_geometry
+import ldraw_part_types
+
+# run on its own in parse_pool's worker processes, which can't import the addon because its __init__ imports bpy
+# the modules it imports don't import the rest of the addon either, and are found by their names
+# in the folder parse_pool adds to the worker's sys.path
+
+geometry_line_types = {"2", "3", "4", "5"}
+
+
+# parse_file for every (filepath, data) of a batch, which is what the pool sends, so that each task is worth
+# sending to a worker
+def parse_files(batch, triangulate, treat_shortcut_as_model):
+    return [parse_file(filepath, data, triangulate, treat_shortcut_as_model) for filepath, data in batch]
+
+
+# reads and parses filepath, or data if the main process has read it already
+# every line is split once, here, and the type 2 to 5 lines are parsed into arrays and left out of the lines
+# returns the lines, the lowercase names the type 1 lines reference and ldraw_geometry's arrays of the geometry
+# the arrays are None and the lines are the bytes of the file if it has no geometry or can't be parsed on its own:
+# if it is an MPD, if it has texmaps, or if any of those lines would be read while it is like a model,
+# since they would go into its extra geometry
+def parse_file(filepath, data, triangulate, treat_shortcut_as_model):
+    if data is None:
+        with open(filepath, mode='rb') as file:
+            data = file.read()
+    try:
+        all_lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8').readlines()
+    except UnicodeDecodeError:
+        # get_file reads what it can of it and reports the rest
+        return data, [], None
+
+    lines = []
+    subfile_names = []
+    geometry = ldraw_geometry.LDrawGeometry()
+    face_count = 0
+    part_type = None
+
+    for line in all_lines:
+        _params = line.split()
+        if len(_params) == 0:
+            continue
+
+        line_type = _params[0]
+        if line_type in geometry_line_types:
+            if geometry is None:
+                continue
+            if ldraw_part_types.is_like_model(part_type, treat_shortcut_as_model):
+                geometry = None
+                continue
+            geometry.parse_face(_params)
+            face_count += 1
+            continue
+
+        lines.append(line)
+        if line_type == "1":
+            if len(_params) > 14:
+                subfile_names.append(" ".join(_params[14:]).lower())
+        elif line_type == "0" and len(_params) > 1:
+            if _params[1] in ["!TEXMAP", "!:"] or (_params[1] == "FILE" and len(_params) > 2):
+                geometry = None
+            elif _params[1] in ldraw_part_types.part_type_commands:
+                actual_part_type = ldraw_part_types.get_actual_part_type(line)
+                if actual_part_type is not None:
+                    part_type = ldraw_part_types.determine_part_type(actual_part_type)
+
+    if geometry is None or face_count == 0:
+        return data, subfile_names, None
+
+    geometry.finalize(triangulate)
+    return lines, subfile_names, geometry.get_arrays()
@@ -0,0 +1,97 @@
+import concurrent.futures
+
+from . import filesystem
+from . import helpers
+from . import ldraw_file
+
+max_workers = 8
+# files referenced past this many unread ones are left for the parser to read
+max_pending = 256
+
+
+class Prefetcher:
+    """
+    Reads the files referenced by the file about to be parsed in a thread pool, so that they are already read
+    by the time LDrawFile.get_file gets to them.
+
+    Of the files get_file reads, ready had been read ahead by the time it needed them, waited were still being read
+    and missed weren't read ahead. bytes_read is everything the threads have read, used or not.
+    """
+
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = {}
+        self.queued = set()
+
+        self.ready = 0
+        self.waited = 0
+        self.missed = 0
+        self.bytes_read = 0
+
+    # the files a file references are located and checked against the parsed file cache here, on the main thread,
+    # and the threads only read them, since they don't touch any state the parser uses
+    def queue_subfiles(self, import_context, lines):
+        for line in lines:
+            if not line.lstrip().startswith("1"):
+                continue
+
+            _params = helpers.clean_line(line).split(maxsplit=14)
+            if len(_params) < 15 or _params[0] != "1":
+                continue
+
+            filename = ldraw_file.get_subfile_name(_params[14].lower())
+            if filename in self.queued or filename in import_context.file_lines_cache:
+                continue
+            if len(self.futures) >= max_pending:
+                return
+            self.queued.add(filename)
+
+            filepath = filesystem.locate(filename, count_missing=False)
+            if filepath is None or filepath in self.futures or filepath in import_context.read_ahead_data:
+                continue
+            if filepath in import_context.read_ahead_lines:
+                continue
+            # get_file won't read a file that has already been parsed
+            if ldraw_file.get_parsed_file(ldraw_file.get_parsed_file_key(filepath)) is not None:
+                continue
+            self.futures[filepath] = self.executor.submit(filesystem.read_bytes, filepath)
+
+    # the bytes of filepath if it was read ahead, otherwise None
+    def get_data(self, filepath):
+        future = self.futures.pop(filepath, None)
+        if future is None:
+            self.missed += 1
+            return None
+
+        is_ready = future.done()
+        try:
+            data = future.result()
+        except Exception:
+            # get_file reads it again and reports what is wrong with it
+            self.missed += 1
+            return None
+
+        self.bytes_read += len(data)
+        if is_ready:
+            self.ready += 1
+        else:
+            self.waited += 1
+        return data
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown()
+
+        for future in self.futures.values():
+            if not future.cancelled() and future.exception() is None:
+                self.bytes_read += len(future.result())
+        self.futures = {}
+
+    def get_summary(self):
+        needed = self.ready + self.waited + self.missed
+        hit_rate = (self.ready + self.waited) / needed if needed > 0 else 0
+        return (
+            f"Prefetch: {self.ready + self.waited} of {needed} files read ahead ({hit_rate:.0%}), "
+            f"{self.waited} of them waited on, {self.bytes_read} bytes read"
+        )
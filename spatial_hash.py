@@ -0,0 +1,180 @@
+import itertools
+
+import numpy as np
+
+neighbor_offsets = np.array(list(itertools.product((-1, 0, 1), repeat=3)), dtype=np.int64)
+# the cell itself and the 13 neighbors that come after it, every neighboring pair of cells is in here once
+forward_offsets = neighbor_offsets[13:]
+
+
+class SpatialHash:
+    """
+    Points bucketed into a grid of cubes, so that every point within cell_size of a query point is found
+    by looking in the query point's cell and the 26 cells around it.
+
+    Work is done per occupied cell instead of per point, so points that share a cell share every lookup.
+    """
+
+    def __init__(self, points, cell_size):
+        self.points = points
+        # any cell size works as long as it isn't smaller than the query distance, so a bigger one is used when the
+        # grid is too large to be keyed or the distance is 0
+        self.cell_size = cell_size if cell_size > 0 else 1.0
+
+        while True:
+            cells = self.get_cells(points)
+            # one empty cell of padding on every side so that the neighbors of an occupied cell never wrap
+            self.origin = cells.min(axis=0) - 1
+            self.spans = cells.max(axis=0) - self.origin + 2
+            if int(self.spans[0]) * int(self.spans[1]) * int(self.spans[2]) < 2 ** 62:
+                break
+            self.cell_size *= 2
+
+        self.cells = self.group(cells - self.origin, np.arange(len(points)))
+
+    def get_cells(self, points):
+        return np.floor(points / self.cell_size).astype(np.int64)
+
+    def get_keys(self, cells):
+        return (cells[:, 0] * self.spans[1] + cells[:, 1]) * self.spans[2] + cells[:, 2]
+
+    # indexes sorted by cell, and the key, grid position, first sorted position and index count of every occupied cell
+    def group(self, cells, indexes):
+        keys = self.get_keys(cells)
+        order = np.argsort(keys, kind='stable')
+        cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+        return indexes[order], cell_keys, cells[order[cell_starts]], cell_starts, cell_counts
+
+    # returns (query indexes, point indexes) of every point within distance of a query point
+    # distance can't be more than cell_size
+    def query_pairs(self, query_points, distance):
+        query_cells = self.get_cells(query_points) - self.origin
+        inside = np.all((query_cells >= 0) & (query_cells < self.spans), axis=1)
+        query_indexes = np.flatnonzero(inside)
+        if len(query_indexes) < 1:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        query_cells = self.group(query_cells[query_indexes], query_indexes)
+        return self.find_pairs(query_cells, query_points, neighbor_offsets, distance)
+
+    # every pair of points within distance of each other, each pair once
+    def self_pairs(self, distance):
+        return self.find_pairs(self.cells, self.points, forward_offsets, distance)
+
+    def find_pairs(self, query_cells, query_points, offsets, distance):
+        query_order, query_keys, cells, query_starts, query_counts = query_cells
+        point_order, point_keys, point_cells, point_starts, point_counts = self.cells
+
+        query_blocks = []
+        point_blocks = []
+        for offset in offsets:
+            neighbor_cells = cells + offset
+            valid = np.all((neighbor_cells >= 0) & (neighbor_cells < self.spans), axis=1)
+            neighbor_keys = self.get_keys(neighbor_cells)
+
+            positions = np.searchsorted(point_keys, neighbor_keys)
+            positions[positions >= len(point_keys)] = 0
+            found = valid & (point_keys[positions] == neighbor_keys)
+            if not np.any(found):
+                continue
+
+            # every query point of each cell against every point of its neighbor
+            block_query_starts = query_starts[found]
+            block_point_starts = point_starts[positions[found]]
+            block_point_counts = point_counts[positions[found]]
+            pair_counts = query_counts[found] * block_point_counts
+
+            total = int(pair_counts.sum())
+            pairs = np.repeat(np.arange(len(pair_counts)), pair_counts)
+            local = np.arange(total) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+            counts = block_point_counts[pairs]
+            block_query_indexes = query_order[block_query_starts[pairs] + local // counts]
+            block_point_indexes = point_order[block_point_starts[pairs] + local % counts]
+
+            deltas = self.points[block_point_indexes] - query_points[block_query_indexes]
+            close = np.einsum('ij,ij->i', deltas, deltas) <= distance * distance
+            query_blocks.append(block_query_indexes[close])
+            point_blocks.append(block_point_indexes[close])
+
+        if len(query_blocks) < 1:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(query_blocks), np.concatenate(point_blocks)
+
+
+# returns the index of the first of each row's duplicates and which of those it is
+def unique_rows(rows):
+    order = np.lexsort(rows.T[::-1])
+    sorted_rows = rows[order]
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = np.any(sorted_rows[1:] != sorted_rows[:-1], axis=1)
+
+    inverse = np.empty(len(rows), dtype=np.int64)
+    inverse[order] = np.cumsum(starts) - 1
+    return order[starts], inverse
+
+
+# returns the index of the point each point is merged into, the same as bmesh.ops.remove_doubles
+# points are visited in index order, and each one that hasn't been merged yet takes every point within distance
+# of it that hasn't been merged yet, so points are only merged into a point they are close to, never along a chain
+def weld_labels(points, distance):
+    if len(points) < 1:
+        return np.empty(0, dtype=np.int64)
+
+    # points that are all but the same, which is most of them, are merged into the first of them
+    # before the neighbor search, the snap is so much smaller than distance that this is what the visit order does
+    # for all but points a thousandth of distance away from being out of range of each other
+    if distance <= 0:
+        first_indexes, inverse = unique_rows(points)
+        return first_indexes[inverse]
+    first_indexes, inverse = unique_rows(np.round(points / (distance * 0.001)))
+    order = np.argsort(first_indexes)
+    first_indexes = first_indexes[order]
+    inverse = np.argsort(order)[inverse]
+
+    spatial_hash = SpatialHash(points[first_indexes], distance)
+    a, b = spatial_hash.self_pairs(distance)
+    different = a != b
+    a, b = np.concatenate((a[different], b[different])), np.concatenate((b[different], a[different]))
+    order = np.argsort(a, kind='stable')
+    a = a[order]
+    b = b[order]
+    starts = np.searchsorted(a, np.arange(len(first_indexes) + 1))
+
+    # only the points that have a neighbor are visited, the rest are merged into nothing and take nothing
+    labels = np.arange(len(first_indexes))
+    merged = np.zeros(len(first_indexes), dtype=bool)
+    for index in np.unique(a).tolist():
+        if merged[index]:
+            continue
+        merged[index] = True
+        neighbors = b[starts[index]:starts[index + 1]]
+        neighbors = neighbors[~merged[neighbors]]
+        labels[neighbors] = index
+        merged[neighbors] = True
+    return first_indexes[labels[inverse]]
+
+
+# returns (a, b), every pair of points where a is within distance of a line's start and b is within distance of its end
+def find_line_pairs(points, starts, ends, distance):
+    if len(points) < 1 or len(starts) < 1:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    spatial_hash = SpatialHash(points, distance)
+    start_lines, start_points = spatial_hash.query_pairs(starts, distance)
+    end_lines, end_points = spatial_hash.query_pairs(ends, distance)
+
+    order = np.argsort(start_lines, kind='stable')
+    start_points = start_points[order]
+    start_counts = np.bincount(start_lines, minlength=len(starts))
+    order = np.argsort(end_lines, kind='stable')
+    end_points = end_points[order]
+    end_counts = np.bincount(end_lines, minlength=len(starts))
+
+    pair_counts = start_counts * end_counts
+    total = int(pair_counts.sum())
+    lines = np.repeat(np.arange(len(starts)), pair_counts)
+    local = np.arange(total) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+    counts = end_counts[lines]
+    a = start_points[(np.cumsum(start_counts) - start_counts)[lines] + local // counts]
+    b = end_points[(np.cumsum(end_counts) - end_counts)[lines] + local % counts]
+    return a, b
@@ -4,16 +4,6 @@ import uuid
 import base64
 import os
 
-texmaps = []
-texmap = None
-
-
-def reset_caches():
-    global texmaps
-    global texmap
-    texmaps = []
-    texmap = None
-
 
 # https://github.com/trevorsandy/lpub3d/blob/e7c39cd3df518cf16521dc2c057a9f125cc3b5c3/lclib/common/lc_meshloader.h#L56
 # https://github.com/trevorsandy/lpub3d/blob/e7c39cd3df518cf16521dc2c057a9f125cc3b5c3/lclib/common/lc_meshloader.cpp#L12